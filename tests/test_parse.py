@@ -0,0 +1,70 @@
+"""
+Checks that both HTML parsers pair each message with its own body,
+run from the repository root with
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from tools.synth import synth_export
+from tools.parse import soup_messages, iter_messages
+
+# Size of the synthetic export both parsers are compared on
+N_MESSAGES = 100000
+
+
+def numbered_export(file_path, n):
+    """
+    Writes an export of n messages whose sender and body give their
+    number, message i having i % 3 paragraphs
+    """
+    with open(file_path, 'wb') as f:
+        f.write('<html><body><div class="contents"><h1>Test</h1>\n'
+                '<div class="thread">User 0, User 1\n')
+        for i in range(n):
+            f.write('<div class="message"><div class="message_header">'
+                    '<span class="user">User %d</span>'
+                    '<span class="meta">Monday, April 10, 2017 at 3:%02dpm UTC+01</span>'
+                    '</div></div>' % (i % 2, i % 60))
+            f.write(''.join('<p>m%d.%d</p>' % (i, k) for k in range(i % 3)))
+        f.write('</div>\n</div></body></html>\n')
+
+
+class PairingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.synth = os.path.join(cls.directory, 'synth.htm')
+        synth_export(cls.synth, N_MESSAGES, 20)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_numbered(self):
+        file_path = os.path.join(self.directory, 'numbered.htm')
+        numbered_export(file_path, 300)
+
+        for master in (soup_messages(file_path), list(iter_messages(file_path))):
+            self.assertEqual(len(master), 300)
+            for i, m in enumerate(master):
+                self.assertEqual(m['sndr'], u'User %d' % (i % 2))
+                self.assertEqual(m['time'].minute, i % 60)
+                self.assertEqual(m['text'], u'\n'.join(u'm%d.%d' % (i, k) for k in range(i % 3)))
+
+    def test_synth(self):
+        soup = soup_messages(self.synth)
+        stream = list(iter_messages(self.synth))
+
+        # Some messages have no body and some two paragraphs
+        self.assertEqual(len(soup), N_MESSAGES)
+        self.assertTrue(any(m['text'] == u'' for m in soup))
+        self.assertTrue(any(u'\n' in m['text'] for m in soup))
+        self.assertEqual(soup, stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+Writes the messages as Arrow files for other tools (pandas, Polars,
+DuckDB) to read directly, and reads them back as a MessageTable.
+Each file has three columns:
+
+    time    timestamp[s]
+    sndr    dictionary<int32, string>, the users and sender codes
+    text    large_string, the UTF-8 buffer and its offsets
+
+The Arrow IPC (Feather v2) file holds the messages in store order as
+one record batch, so its columns are the store's own buffers and a
+memory map of it can be used without copying the texts. The Parquet
+file holds them sorted by time, one row group per month.
+
+Needs pyarrow, which is not required for anything else.
+"""
+import os
+import numpy as np
+from tools.table import MessageTable
+from tools.instrument import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def arrow_paths(prefix):
+    """
+    Arrow files of the store at prefix
+    """
+    return {'ipc': prefix + '.arrow', 'parquet': prefix + '.parquet'}
+
+
+def require():
+    """
+    Fails with a useful message if pyarrow is missing
+    """
+    if pa is None:
+        raise ImportError('Arrow export needs pyarrow (pip install pyarrow)')
+
+
+def arrow_table(table):
+    """
+    A pyarrow Table of a MessageTable, sharing its buffers where
+    the types allow (sender codes and texts)
+    """
+    require()
+    n = len(table)
+    offsets = np.ascontiguousarray(table.offsets - table.offsets[0], dtype='int64')
+    blob = np.ascontiguousarray(table.blob[table.offsets[0]:table.offsets[-1]])
+
+    times = pa.array(np.asarray(table.times, dtype='datetime64[s]'), type=pa.timestamp('s'))
+    sndrs = pa.DictionaryArray.from_arrays(
+        pa.array(np.ascontiguousarray(table.sndrs, dtype='int32'), type=pa.int32()),
+        pa.array(list(table.users), type=pa.string()))
+    texts = pa.Array.from_buffers(pa.large_string(), n,
+                                  [None, pa.py_buffer(offsets), pa.py_buffer(blob)])
+
+    return pa.Table.from_arrays([times, sndrs, texts], ['time', 'sndr', 'text'])
+
+
+def arrow_export(table, prefix):
+    """
+    Writes a MessageTable as an Arrow IPC file and a Parquet file
+    alongside the store at prefix
+    """
+    require()
+    paths = arrow_paths(prefix)
+
+    with stage('arrow', len(table)):
+        at = arrow_table(table)
+        with open(paths['ipc'] + '.tmp', 'wb') as f:
+            writer = pa.RecordBatchFileWriter(f, at.schema)
+            writer.write_table(at)
+            writer.close()
+
+    # Row groups of one month each, in time order
+    with stage('parquet', len(table)):
+        ordered = table.take(table.argsort())
+        month = np.asarray(ordered.times, dtype='datetime64[M]').astype('int64')
+        bounds = np.concatenate([[0], np.nonzero(np.diff(month))[0] + 1, [len(month)]])
+        at = arrow_table(ordered)
+        writer = pq.ParquetWriter(paths['parquet'] + '.tmp', at.schema)
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            writer.write_table(at.slice(lo, hi - lo))
+        writer.close()
+
+    for path in paths.values():
+        os.rename(path + '.tmp', path)
+    print 'Wrote %s and %s' % (paths['ipc'], paths['parquet'])
+
+
+def arrow_load(file_path):
+    """
+    Opens an Arrow IPC file (as written by arrow_export, or by any
+    tool with the same columns) as a MessageTable over a memory map
+    of it. The sender codes and, for large_string texts, the text
+    buffer and offsets are used in place; the times are converted
+    to minutes, and string offsets widened to 64 bits.
+    """
+    require()
+    source = pa.memory_map(file_path, 'r')
+    reader = pa.ipc.open_file(source)
+    tables = [batch_table(reader.get_batch(i)) for i in range(reader.num_record_batches)]
+    return tables[0] if len(tables) == 1 else MessageTable.concat(tables)
+
+
+def batch_table(batch):
+    """
+    A MessageTable over the buffers of one record batch
+    """
+    n = batch.num_rows
+    names = batch.schema.names
+    times, sndrs, texts = [batch.column(names.index(c)) for c in ('time', 'sndr', 'text')]
+
+    # Plain string senders are given codes here
+    if not isinstance(sndrs.type, pa.DictionaryType):
+        sndrs = sndrs.dictionary_encode()
+    codes = buffer_array(sndrs.indices, 1, sndrs.indices.type.to_pandas_dtype())
+
+    minutes = buffer_array(times, 1, 'int64').view('datetime64[%s]' % times.type.unit)
+
+    large = texts.type == pa.large_string()
+    offsets = buffer_array(texts, 1, 'int64' if large else 'int32', n + 1)
+    data = texts.buffers()[2]
+    blob = (np.frombuffer(data, dtype='uint8') if data is not None and data.size
+            else np.zeros(0, dtype='uint8'))
+
+    return MessageTable(minutes.astype('datetime64[m]'), codes.astype('int32', copy=False),
+                        sndrs.dictionary.to_pylist(), offsets.astype('int64', copy=False),
+                        blob)
+
+
+def buffer_array(arr, i, dtype, n=None):
+    """
+    Buffer i of an Arrow array as a numpy array of its n values
+    (one per element by default), without copying
+    """
+    n = len(arr) if n is None else n
+    return np.frombuffer(arr.buffers()[i], dtype=dtype)[arr.offset:arr.offset + n]
@@ -0,0 +1,181 @@
+"""
+Benchmarks for the parsing and analysis tools. Run from the
+repository root, e.g.
+
+    python -m tools.bench parse ./input/messages.htm
+    python -m tools.bench suite ./input/messages.htm results.json
+    python -m tools.bench imports
+
+Synthetic exports of any size can be made with tools.synth.
+"""
+import os
+import json
+import shutil
+import platform
+import subprocess
+import sys
+import numpy as np
+from sys import argv
+from time import time, strftime
+from tempfile import mkdtemp
+from multiprocessing import Process, Queue
+from tools.parse import soup_messages, iter_messages, thread_parse
+from tools.store import table_load
+from tools.instrument import peak_rss
+
+
+def measure(func, *args, **kwargs):
+    """
+    Runs func(*args) in a fresh process and returns its wall time,
+    peak RSS and the number of items it returned. Running each
+    measurement in its own process keeps the peak RSS figures
+    independent of each other. If a setup function is given
+    (as a keyword argument) its result is passed as the first
+    argument of func, and the time it takes is not counted.
+    """
+    setup = kwargs.get('setup')
+
+    def target(q):
+        if setup is not None:
+            args_ = (setup(),) + args
+        else:
+            args_ = args
+        base = peak_rss()
+        t0 = time()
+        result = func(*args_)
+        q.put({'wall': time() - t0, 'peak_rss': peak_rss(), 'base_rss': base,
+               'items': len(result) if hasattr(result, '__len__') else None})
+
+    q = Queue()
+    p = Process(target=target, args=(q,))
+    p.start()
+    result = q.get()
+    p.join()
+    return result
+
+
+def parse_benchmark(file_path):
+    """
+    Compares the BeautifulSoup and streaming parsers on one file
+    """
+    modes = [('soup', soup_messages),
+             ('stream', lambda x: list(iter_messages(x)))]
+
+    results = {}
+    for name, func in modes:
+        results[name] = measure(func, file_path)
+        print '{name:8} {wall:8.2f}s {peak_rss:10.1f}MB {items:>10} msgs'.format(
+            name=name, **results[name])
+    return results
+
+
+# Analyses timed by the suite, each on a freshly loaded GroupChat
+ANALYSES = [
+    ('user_sort', lambda g: g.user_bins),
+    ('message_sort', lambda g: g.sorted_master),
+    ('cluster_find', lambda g: g.cluster_find()),
+    ('conversation_matrix', lambda g: g.conversation_matrix()),
+    ('time_bins', lambda g: g.time_bins(g.times)),
+    ('time_bins_user', lambda g: g.time_plot_user_data(g.users)['avgs']),
+    ('daily_bins', lambda g: g.group_daily_bins()),
+    ('weekly_bins', lambda g: g.group_daily_bins(weekday=True)),
+    ('user_daily_bins', lambda g: g.user_daily_bins()),
+    ('word_find', lambda g: g.word_find([u'pub', u'tonight'])),
+    ('word_groups', lambda g: g.word_groups([[u'pub'], [u'ok', u'lol'], [u'haha']])),
+    ('message_lengths', lambda g: g.message_length_plot_data()['length_dist']),
+    ('word_lengths', lambda g: g.word_length_plot_data()['means']),
+]
+
+
+def suite_benchmark(file_path, out=None):
+    """
+    Times parsing file_path into a message store, loading it
+    and each analysis in ANALYSES, printing a table of the
+    results and writing them as JSON to out if given
+    """
+    from tools.chat import GroupChat
+
+    prefix = os.path.join(mkdtemp(), 'group_chat')
+
+    # The result cache is left off, so each analysis is timed
+    # rather than the loading of its result
+    def chat():
+        g = GroupChat(table_load(prefix), prefix)
+        g.results = None
+        return g
+
+    results = {}
+    try:
+        cases = [('parse', measure(thread_parse, file_path, True, prefix)),
+                 ('load', measure(chat))]
+        size, users = chat().size, len(chat().users)
+        cases += [(name, measure(func, setup=chat)) for name, func in ANALYSES]
+    finally:
+        shutil.rmtree(os.path.dirname(prefix))
+
+    for name, r in cases:
+        results[name] = r
+        print '{name:20} {wall:8.3f}s {peak_rss:10.1f}MB'.format(name=name, **r)
+
+    report = {'file': os.path.abspath(file_path),
+              'file_size': os.path.getsize(file_path),
+              'messages': size,
+              'users': users,
+              'date': strftime('%Y-%m-%dT%H:%M:%S'),
+              'commit': git_commit(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'results': results}
+
+    if out:
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+
+# Modules timed by the import benchmark, and the packages
+# the analyses should import without being asked to
+IMPORTS = ['numpy', 'tools.chat', 'main', 'tools.render']
+HEAVY = ['matplotlib', 'bs4', 'lxml', 'pyarrow']
+
+
+def import_benchmark(modules=IMPORTS, repeat=5):
+    """
+    Times importing each module in a fresh interpreter (the
+    best of repeat runs) and lists the heavy packages it loads
+    """
+    code = ('import sys, time; t = time.time(); import %s; print time.time() - t; '
+            'print " ".join(set(m.split(".")[0] for m in sys.modules))')
+
+    results = {}
+    for module in modules:
+        runs = [subprocess.check_output([sys.executable, '-c', code % module]).split('\n')
+                for _ in range(repeat)]
+        loaded = set(runs[0][1].split())
+        results[module] = {'wall': min(float(r[0]) for r in runs),
+                           'heavy': [h for h in HEAVY if h in loaded]}
+        print '{name:16} {wall:8.3f}s  {heavy}'.format(
+            name=module, wall=results[module]['wall'],
+            heavy=', '.join(results[module]['heavy']) or '-')
+    return results
+
+
+def git_commit():
+    """
+    The commit of the working tree being benchmarked, if known
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+
+    if argv[1] == 'parse':
+        parse_benchmark(argv[2])
+    elif argv[1] == 'suite':
+        suite_benchmark(argv[2], argv[3] if len(argv) > 3 else None)
+    elif argv[1] == 'imports':
+        import_benchmark()
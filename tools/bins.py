@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def daily_counts(times, weekday=False, groups=None, n_groups=None):
+    """
+    Counts messages in 1 minute bins over the day, shape (1440,),
+    or over the week with weekday=True, shape (7, 1440). Given a group
+    code for each message (e.g. sender codes) the counts of every
+    group are made in the same pass, shape (n_groups, ...).
+    """
+    minutes = np.asarray(times, dtype='datetime64[m]').astype('int64')
+
+    # Minute of the day, then day of the week (1970-01-01 was a Thursday)
+    cell = minutes % 1440
+    shape = (1440,)
+    if weekday:
+        cell += 1440 * ((minutes // 1440 + 3) % 7)
+        shape = (7, 1440)
+
+    if groups is not None:
+        n_groups = n_groups or int(np.max(groups, initial=-1)) + 1
+        cell += 1440 * (7 if weekday else 1) * np.asarray(groups, dtype='int64')
+        shape = (n_groups,) + shape
+
+    return np.bincount(cell, minlength=int(np.prod(shape))).reshape(shape)
+
+
+def moving_average(data, window):
+    """
+    Simple circular moving average
+    """
+
+    dd = np.concatenate((data, data))
+
+    return np.convolve(np.ones(window) / float(window), dd)[window: len(data) + window]
+
+
+def rolling_mean(data, window):
+    """
+    Moving average along the last axis, the same as
+    np.convolve(row, np.ones(window) / window, mode='same') for
+    each row, from running sums rather than a convolution
+    """
+    data = np.asarray(data)
+    n = data.shape[-1]
+    prefix = np.zeros(data.shape[:-1] + (n + 1,), dtype=np.result_type(data, 'int64'))
+    np.cumsum(data, axis=-1, out=prefix[..., 1:])
+
+    # Output k averages the inputs within the window centred on it,
+    # as far as they go
+    k = np.arange(max(n, window)) + (min(n, window) - 1) // 2
+    hi = np.clip(k + 1, 0, n)
+    lo = np.clip(k - window + 1, 0, n)
+    return (prefix[..., hi] - prefix[..., lo]) / float(window)
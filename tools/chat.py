@@ -0,0 +1,729 @@
+"""
+The analysis side of the group chat tools. Only needs numpy: the
+plots are drawn by tools.render, imported the first time one is made,
+and the HTML parsers are imported when a file is parsed.
+"""
+import numpy as np
+from random import randint
+from tools.parse import thread_update
+from tools.table import MessageTable, MessageView
+from tools.cluster import cluster_ids, conversation_counts
+from tools.bins import daily_counts, moving_average, rolling_mean
+from tools.cube import TimeCube
+from tools.index import TextIndex, index_load, index_save, multi_search
+from tools.textstats import TextStats
+from tools.replies import Replies
+from tools.lazy import cached_property, invalidate, memoize, renderer
+from tools.store import table_load, store_header
+from tools.results import ResultCache, persist, store_hash, table_hash
+from tools.instrument import timed
+
+
+class GroupChat:
+
+    def __init__(self, master_list, prefix=None):
+
+        # Holds the messages in columns, either given as a
+        # MessageTable or converted from a list of message dicts
+        if isinstance(master_list, MessageTable):
+            self.table = master_list
+        else:
+            self.table = MessageTable.from_records(master_list)
+
+        # Where the messages are stored, if they came from the store,
+        # and where the results of analysing them are kept
+        self.prefix = prefix
+        self.results = ResultCache() if prefix else None
+
+        # The master list of messages is a view over the table
+        self.master = self.table.records()
+        self.size = len(self.table)
+
+        # Get the unique users in this groupchat
+        self.users = self.table.users
+
+        # Get their initials
+        self.users_initials = [''.join(map(lambda x: x[0],
+                               u.split(' '))) for u in self.users]
+
+        # Find max length of user names
+        self.max_len = max(len(p) for p in self.users) + 1
+
+        # np.array of message times for easier manipulation
+        self.times = self.table.times
+
+        # Everything derived from the messages (user bins, sorted
+        # messages, totals, conversations, daily counts, text index
+        # and statistics)
+        # is computed on first use by the cached properties below
+
+    @classmethod
+    def from_arrow(cls, file_path):
+        """
+        Opens an Arrow IPC file of messages (see tools/arrow.py) as
+        a groupchat over a memory map of it
+        """
+        from tools.arrow import arrow_load
+        return cls(arrow_load(file_path))
+
+    @cached_property
+    @timed
+    def user_index(self):
+        """
+        Indices of each user's messages
+        """
+        return self.user_group(self.table.sndrs, len(self.users))
+
+    @cached_property
+    def user_bins(self):
+        """
+        Messages sorted per user
+        """
+        return self.user_sort()
+
+    @cached_property
+    @timed
+    def sorted_ix(self):
+        """
+        Indices of the messages sorted by time
+        """
+        return self.message_sort(self.master).indices()
+
+    @cached_property
+    def sorted_master(self):
+        """
+        The master list sorted by time
+        """
+        return self.table.records(self.sorted_ix)
+
+    @cached_property
+    def totals(self):
+        """
+        Total messages of each user
+        """
+        return np.bincount(self.table.sndrs, minlength=len(self.users)).astype(float)
+
+    @cached_property
+    @timed
+    def convo_ix(self):
+        """
+        Conversation number of each time-sorted message
+        """
+        return cluster_ids(self.times[self.sorted_ix])
+
+    @cached_property
+    def convos(self):
+        """
+        Messages clustered into conversations
+        """
+        return self.cluster_views(self.convo_ix)
+
+    @cached_property
+    @timed
+    def data_hash(self):
+        """
+        Hash of the messages, keying their results in the cache.
+        Messages parsed into the store are keyed on its header,
+        anything else on all of its contents.
+        """
+        header = store_header(self.prefix) if self.prefix else None
+        if header is not None and header['source_hash'] and header['size'] == self.size:
+            return store_hash(header, self.table)
+        return table_hash(self.table)
+
+    @cached_property
+    @timed
+    def cube(self):
+        """
+        Messages of each user on each day, for time_bins
+        """
+        return TimeCube.build(self.times, self.table.sndrs, len(self.users))
+
+    @cached_property
+    @timed
+    def index(self):
+        """
+        Inverted index of the message texts, loaded from the
+        store if it has one, otherwise built (and saved there)
+        """
+        index = index_load(self.prefix, self.size) if self.prefix else None
+        if index is None:
+            index = TextIndex.build(self.table)
+            if self.prefix:
+                index_save(index, self.prefix)
+        return index
+
+    @cached_property
+    @timed
+    def text_stats(self):
+        """
+        Word counts and word length histograms of the messages,
+        from one pass over the text buffer
+        """
+        return TextStats.build(self.table)
+
+    def invalidate(self, *names):
+        """
+        Forgets the named derived state (or all of it) and every
+        memoized result, to be recomputed when next used
+        """
+        invalidate(self, *names)
+
+    def update(self, file_path, prefix=None):
+        """
+        Adds the new messages from a fresh export of this chat
+        to its message store (or the one at prefix) and to this
+        groupchat
+        """
+        prefix = prefix or self.prefix
+        if prefix is None:
+            raise ValueError('This chat has no message store to update')
+
+        new = thread_update(file_path, prefix)
+        self.append(new, table_load(prefix) if prefix == self.prefix else None)
+
+    def append(self, new, table=None):
+        """
+        Adds a MessageTable of messages no older than any already
+        in the chat, extending the per-user bins, totals and
+        conversations already computed rather than rebuilding them.
+        table, if given, already holds the chat's messages followed
+        by the new ones (as the store does once they are written),
+        saving joining them in memory.
+        """
+        n = self.size
+        self.table = table if table is not None else MessageTable.concat([self.table, new])
+        self.master = self.table.records()
+        self.size = len(self.table)
+        self.times = self.table.times
+
+        # Add any new users
+        n_users = len(self.users)
+        self.users = self.table.users
+        self.users_initials = [''.join(map(lambda x: x[0],
+                               u.split(' '))) for u in self.users]
+        self.max_len = max(len(p) for p in self.users) + 1
+
+        # Views are cheap to remake from the extended indices,
+        # and any memoized results are out of date
+        computed = set(self.__dict__)
+        self.invalidate('user_bins', 'sorted_master', 'convos', 'data_hash')
+
+        # Sort the new messages into the user bins
+        if 'user_index' in computed:
+            new_index = self.user_group(self.table.sndrs[n:], len(self.users))
+            old_index = self.user_index + [np.zeros(0, dtype='int64')] * (
+                len(self.users) - n_users)
+            self.user_index = [np.concatenate([a, b + n])
+                               for a, b in zip(old_index, new_index)]
+
+        # Add the new messages to each user's total
+        if 'totals' in computed:
+            self.totals = np.bincount(self.table.sndrs[n:], minlength=len(self.users)) + \
+                np.concatenate([self.totals, np.zeros(len(self.users) - n_users)])
+
+        # New messages all come after the old ones in time order
+        if 'sorted_ix' in computed:
+            order = np.argsort(self.times[n:], kind='mergesort') + n
+            self.sorted_ix = np.concatenate([self.sorted_ix, order])
+
+        # Carry on clustering from the last conversation
+        if 'convo_ix' in computed:
+            ids = cluster_ids(self.times[self.sorted_ix[n - 1:]]) + self.convo_ix[-1]
+            self.convo_ix = np.concatenate([self.convo_ix, ids[1:]])
+
+        # Count the new messages into the days
+        if 'cube' in computed:
+            self.cube = self.cube.extend(self.times[n:], self.table.sndrs[n:], len(self.users))
+
+        # Index the new texts, unless the store's index has them
+        if 'index' in computed:
+            index = index_load(self.prefix, self.size) if table is not None else None
+            self.index = index or self.index.extend(self.table)
+
+        # Count the words of the new texts
+        if 'text_stats' in computed:
+            self.text_stats = self.text_stats.extend(self.table)
+
+    def user_sort(self):
+        """
+        Sorts the master lists into individual lists
+        for each user. The lists are views over the table,
+        indexed by one group-by of the sender codes.
+        """
+        return self.user_views(self.user_index)
+
+    def user_views(self, user_index):
+        """
+        Per-user bins of messages, texts and dates, each a lazy
+        view over the table at that user's message indices
+        """
+        return [{'Name': n,
+                 'msgs': MessageView(self.table, ix),
+                 'texts': MessageView(self.table, ix, 'text'),
+                 'dates': MessageView(self.table, ix, 'time'),
+                 'bins': []} for n, ix in zip(self.users, user_index)]
+
+    @staticmethod
+    def user_group(sndrs, n_users):
+        """
+        Splits message indices by sender code, in message order
+        """
+        order = np.argsort(sndrs, kind='mergesort')
+        counts = np.bincount(sndrs, minlength=n_users)
+        return np.split(order, np.cumsum(counts)[:-1])
+
+    @timed
+    def cluster_find(self, threshold=30.0):
+        """
+        Clusters messages into conversations based on gaps.
+        Cluster boundaries are placed where the differenence
+        in time between two sequential messages is larger than
+        the chosed threshold. 30 minutes seems to work pretty well
+        but it vary in more extreme group chats.
+        """
+        return self.cluster_views(cluster_ids(self.times[self.sorted_ix], threshold))
+
+    def cluster_views(self, convo_ix):
+        """
+        Stores each cluster's messages in a dict, as a view
+        over the time-sorted messages
+        """
+        bounds = np.nonzero(np.diff(convo_ix))[0] + 1
+        return [{'msgs': MessageView(self.table, ix)}
+                for ix in np.split(self.sorted_ix, bounds)]
+
+    @timed
+    @memoize
+    @persist
+    def conversation_matrix(self, threshold=30.0):
+        """
+        Calculates the conversation matrix for the whole
+        group chat as follows:
+        When a user takes parts in a conversation with
+        another user, the matrix entry between those users receives
+        a point. When all conversations have been added, each row is divided
+        by that user's total messages and normalised by the sum of all
+        that user's points.
+        Pass a list of thresholds to get one matrix for each.
+        """
+        if np.ndim(threshold):
+            return [self.conversation_matrix(t) for t in threshold]
+
+        # Points from the conversation x user incidence matrix
+        convo_matrix = conversation_counts(
+            self.times[self.sorted_ix], self.table.sndrs[self.sorted_ix],
+            len(self.users), threshold).astype(float)
+
+        # Normalise
+        convo_matrix /= self.totals[:, np.newaxis]
+        convo_matrix /= convo_matrix.sum(axis=1)[:, np.newaxis] / 100.0
+
+        return convo_matrix
+
+    @timed
+    @memoize
+    def reply_stats(self, threshold=30.0):
+        """
+        Who replies to whom and how fast: every change of sender
+        within threshold minutes of the message before, counted
+        by pair and latency in one pass over the sorted messages
+        """
+        return Replies.build(self.times[self.sorted_ix], self.table.sndrs[self.sorted_ix],
+                             len(self.users), threshold)
+
+    @staticmethod
+    def message_sort(msgs, reverse=False):
+        """
+        Sorts a list of messages by time (oldest first)
+        """
+        if isinstance(msgs, MessageView):
+            return msgs.sorted(reverse=reverse)
+
+        mtimes = np.array([m['time'] for m in msgs],
+                          dtype='datetime64[m]')
+
+        return [y for (x, y) in sorted(zip(mtimes, msgs),
+                                       reverse=reverse)]
+
+    def random(self, n=5):
+        """
+        Prints five random messages from the group chat 
+        """
+        ix = [randint(0, len(self.master)) for _ in range(n)]
+        for i in ix:
+            print self.message_string(self.master[i])
+
+    def message_string(self, msg):
+        return (
+            '{date} {name:{width}} {text}'.format(
+                name=msg['sndr'], width=self.max_len,
+                date=msg['time'].strftime('%d/%m/%y %H:%M'),
+                text=msg['text'].encode('utf-8'))
+        )
+
+    @timed
+    def message_rank(self):
+        """
+        Prints the total message counts for each user
+        """
+        counts = np.bincount(self.table.sndrs, minlength=len(self.users))
+        rank = np.argsort(-counts, kind='mergesort')
+        ranked_users = [self.users[i] for i in rank]
+        ranked_counts = counts[rank]
+        percentiles = 100.0 * ranked_counts / self.size
+
+        for x, y, p in zip(ranked_users, ranked_counts, percentiles):
+            print '{name:{width}} {counts:<6} {perc:.2f}%'.format(
+                name=x, width=self.max_len, counts=y, perc=p)
+
+    @timed
+    @memoize
+    @persist
+    def time_bins(self, times_list, bin_size=1):
+        """
+        Finds the messages per bin_size (in days) over
+        the whole group chat. All the messages are binned from
+        the daily counts of the cube; any other times are counted
+        into days over the same span first.
+        """
+        if times_list is self.times:
+            return self.cube.bins(bin_size)
+
+        cube = TimeCube.build(times_list, np.zeros(len(times_list), dtype='int64'), 1,
+                              self.cube.t0, self.cube.t1)
+        return cube.bins(bin_size)
+
+    def time_plot(self, bin_size=1, window=30):
+
+        print 'Plotting total group activity with time'
+        renderer().time_plot(**self.time_plot_data(bin_size, window))
+
+    @timed
+    @persist
+    def time_plot_data(self, bin_size=1, window=30):
+        """
+        Messages per bin over the whole group chat and their
+        moving average, as drawn by time_plot
+        """
+        timex, timey = self.cube.bins(bin_size)
+
+        # Create moving average
+        avg = rolling_mean(timey, window)
+
+        return {'timex': timex, 'timey': timey, 'avg': avg, 'bin_size': bin_size}
+
+    def time_plot_user(self, names, bin_size=1, window=30):
+
+        print 'Plotting individual activity with time'
+        renderer().time_plot_user(**self.time_plot_user_data(names, bin_size, window))
+
+    @timed
+    @persist
+    def time_plot_user_data(self, names, bin_size=1, window=30):
+        """
+        Moving average of each named user's messages per bin,
+        as drawn by time_plot_user
+        """
+        # Get data to be plotted for all the users at once
+        codes = [self.users.index(name) for name in names]
+        time, counts = self.cube.bins(bin_size, users=codes, per_user=True)
+
+        avgs = list(rolling_mean(counts, window))
+        return {'names': list(names), 'times': [time] * len(codes),
+                'avgs': avgs, 'bin_size': bin_size}
+
+    def matrix_plot(self):
+
+        print 'Plotting conversation matrix'
+        renderer().matrix_plot(**self.matrix_plot_data())
+
+    @timed
+    @persist
+    def matrix_plot_data(self):
+        """
+        The conversation matrix, as drawn by matrix_plot
+        """
+        return {'convo_matrix': self.conversation_matrix(),
+                'initials': self.users_initials}
+
+    def reply_plot(self, latency=False, threshold=30.0):
+        """
+        Plots the share of each user's replies given to each other
+        user, or with latency=True the median minutes they take
+        """
+
+        print 'Plotting reply matrix'
+        renderer().matrix_plot(**self.reply_plot_data(latency, threshold))
+
+    @timed
+    @persist
+    def reply_plot_data(self, latency=False, threshold=30.0):
+        """
+        Reply shares or median reply latencies, as drawn by reply_plot
+        """
+        replies = self.reply_stats(threshold)
+        if latency:
+            return {'convo_matrix': replies.latency_percentiles()[:, :, 0],
+                    'initials': self.users_initials, 'title': 'Reply Latency Matrix',
+                    'label': 'Median Minutes for $Y$ to Reply to $X$',
+                    'file_name': 'Reply_Latency_Matrix_All_User'}
+        return {'convo_matrix': replies.share(), 'initials': self.users_initials,
+                'title': 'Reply Matrix', 'label': "Share of $Y$'s Replies Which Answer $X$ (%)",
+                'file_name': 'Reply_Matrix_All_User'}
+
+    def text_index(self):
+        """
+        The inverted index of the message texts
+        """
+        return self.index
+
+    def word_print(self, words, match='substring'):
+        """
+        Prints all the occurences of the words in
+        [words] from the chat
+        """
+        for i in self.text_index().find(words, self.table, match):
+            print self.message_string(self.master[i])
+
+    @timed
+    def word_find(self, words, match='substring'):
+        """
+        Finds all the occurences in time of the words in [words].
+        By default a word can match anywhere in a message, with
+        match='token' only whole words match (ignoring case).
+        """
+        return self.times[self.text_index().find(words, self.table, match)]
+
+    @timed
+    def word_groups(self, words):
+        """
+        Finds the occurences in time of each group of words in
+        [words] (a list of lists) with a single pass over the
+        texts, returning one array of times per group
+        """
+        msgs, groups = multi_search(self.table, words)
+        return [self.times[msgs[groups == k]] for k in range(len(words))]
+
+    def word_plot(self, words, bin_size=30):
+        """
+        Plots the occurrence rate of words over time, given as a list of lists
+        where each sublist is all the possible spellings of that word.
+        Or use for general categories grouped together. Each sublist
+        is used as one line in the plot.
+        """
+        renderer().word_plot(**self.word_plot_data(words, bin_size))
+
+    @timed
+    def word_plot_data(self, words, bin_size=30):
+        """
+        Occurrence rate over time of each group of words,
+        as drawn by word_plot
+        """
+        full_string = ','.join([','.join(w) for w in words]).replace(' ', '')
+
+        # Loop over groups of words
+        t0 = self.cube.bins(bin_size)
+        times, rates = [], []
+        for tl in self.word_groups(words):
+            tb = self.time_bins(tl, bin_size=bin_size)
+            times.append(tb[0])
+            rates.append(100.0 * tb[1].astype(float) / t0[1].astype(float))
+
+        return {'labels': [','.join(w).replace(' ', '') for w in words],
+                'times': times, 'rates': rates, 'bin_size': bin_size,
+                'full_string': full_string}
+
+    def daily_plot(self, names=None, window=60):
+        """
+        Plots activity per-user or per-whole group over 1 min bins
+        across the whole day, uses a moving average of size window
+        """
+
+        print 'Plotting group daily activity'
+        renderer().daily_plot(**self.daily_plot_data(names, window))
+
+    @timed
+    @persist
+    def daily_plot_data(self, names=None, window=60):
+        """
+        Moving averages of the daily activity, as drawn by daily_plot
+        """
+
+        # If names are given, plot the individuals, otherwise
+        # plot the whole group
+        if names:
+
+            # Get data to be plotted for all users at once
+            data = self.user_daily_bins()
+            return {'title': '%d-User Daily Activity' % len(names), 'names': list(names),
+                    'avgs': [moving_average(data[self.users.index(name)], window)
+                             for name in names]}
+        else:
+            raw = self.group_daily_bins()
+            return {'title': 'All-User Daily Activity', 'raw': raw,
+                    'avgs': [moving_average(raw, window)]}
+
+    def weekly_plot(self, window=60):
+        """
+        Plots the activity over the whole over the week
+        with a moving average of size window
+        """
+
+        print 'Plotting weekly activity'
+        renderer().weekly_plot(**self.weekly_plot_data(window))
+
+    @timed
+    @persist
+    def weekly_plot_data(self, window=60):
+        """
+        Moving average of the activity over each day of the
+        week, as drawn by weekly_plot
+        """
+        d = self.group_daily_bins(weekday=True)
+        avg = []
+        for i in range(7):
+            avg.append(moving_average(d[i, :], 60))
+
+        return {'avg': np.array(avg)}
+
+    def message_length_plot(self):
+
+        print 'Plotting Message Lengths'
+        renderer().message_length_plot(**self.message_length_plot_data())
+
+    @timed
+    @persist
+    def message_length_plot_data(self):
+        """
+        Length in words of every message, as drawn by message_length_plot
+        """
+        return {'length_dist': self.text_stats.word_counts}
+
+    def word_length_plot(self):
+        """
+        Plots the distribution of word lengths for all users
+        """
+
+        print 'Plotting Word Length Distributions'
+        renderer().word_length_plot(**self.word_length_plot_data())
+
+    @timed
+    @persist
+    def word_length_plot_data(self):
+        """
+        Mean and standard deviation of each user's word lengths,
+        as drawn by word_length_plot
+        """
+        means, percs, mean = self.text_stats.word_length_stats()
+
+        return {'users': self.users, 'means': means, 'percs': percs, 'mean': mean}
+
+    def all(self):
+        """
+        The interactive equivalent of running the script with the
+        -all flag.
+        """
+        print 'Performing all analysis...'
+        self.time_plot()
+        self.time_plot_user(self.users)
+        self.matrix_plot()
+        self.daily_plot()
+        self.daily_plot(names=self.users)
+        self.weekly_plot()
+        self.message_length_plot()
+        self.word_length_plot()
+
+    @timed
+    def report(self, workers=None):
+        """
+        Makes the same plots as all, computing everything here
+        and then rendering the figures on a pool of worker
+        processes (one per CPU by default)
+        """
+        print 'Performing all analysis...'
+        jobs = [('time_plot', self.time_plot_data()),
+                ('time_plot_user', self.time_plot_user_data(self.users)),
+                ('matrix_plot', self.matrix_plot_data()),
+                ('daily_plot', self.daily_plot_data()),
+                ('daily_plot', self.daily_plot_data(names=self.users)),
+                ('weekly_plot', self.weekly_plot_data()),
+                ('message_length_plot', self.message_length_plot_data()),
+                ('word_length_plot', self.word_length_plot_data())]
+
+        print 'Rendering %d plots...' % len(jobs)
+        renderer().batch(jobs, workers)
+
+    @staticmethod
+    @timed
+    def daily_bins(times, weekday=False):
+        """
+        Bins a list of messages over the day/week in 1 minute bins.
+        """
+        return daily_counts(times, weekday) / 1440.0
+
+    @timed
+    @memoize
+    @persist
+    def group_daily_bins(self, weekday=False):
+        """
+        Same as daily_bins for all the messages, kept for
+        the next call
+        """
+        return self.daily_bins(self.times, weekday)
+
+    @timed
+    @memoize
+    @persist
+    def user_daily_bins(self, weekday=False):
+        """
+        Same as daily_bins but for every user in one pass,
+        indexed in the same order as self.users
+        """
+        return daily_counts(self.times, weekday, groups=self.table.sndrs,
+                            n_groups=len(self.users)) / 1440.0
+
+    @staticmethod
+    def fig_watermark(fig, title):
+        """
+        Adds a watermark and title to every plot
+        """
+        return renderer().fig_watermark(fig, title)
+
+    @staticmethod
+    def help():
+        print """
+    The messages and all the analysis tools are handled
+    by the groupchat object. The full list of
+    messages is in groupchat.master.
+    
+    Each message in the master list is a dict with three
+    keys:
+    ['sndr']    A string with the sender's name
+    ['time']    A datetime object for the message's sent time
+    ['text']    The actual message body
+
+    The same messages are held in columns in groupchat.table
+    (times, sender codes into groupchat.users and texts).
+    
+    Below are most of the included methods which you can use
+    to analyse the chat. All outputs are saved in ./plots/
+
+    * groupchat.random(n=5)
+        Prints n randomly chosen messages from the chat
+        
+    * groupchat.message_rank()
+        Prints every user's total message count in order
+         
+    * groupchat.time_plot_user(names)
+        Same as above but plots individual activity for
+        any of the names passed in {names} (must be a list)
+        
+    * groupchat.word_use([words])
+        Plots the use of specific words in the provided
+        list over time.
+
+    * groupchat.reply_plot(latency=False)
+        Plots who replies to whom, or with latency=True
+        how many minutes they take to reply
+    """
@@ -0,0 +1,303 @@
+import numpy as np
+from tools.table import MessageTable
+from tools.store import table_load
+from tools.cluster import cluster_ids, incidence, coparticipation
+from tools.bins import daily_counts, moving_average, rolling_mean
+from tools.cube import TimeCube
+from tools.index import TOKEN, blob_search
+from tools.textstats import TextStats, hist_add
+from tools.replies import Replies
+from tools.lazy import cached_property, memoize, renderer
+from tools.instrument import timed
+
+# Messages read from the store at once
+CHUNK = 1 << 20
+
+
+class ChunkedChat:
+    """
+    Runs the main analyses of GroupChat over a message store too big
+    to hold in memory, reading it in chunks of chunk_size messages
+    and merging the partial results. Memory use is bounded by the
+    chunk size rather than the size of the chat; the results are the
+    same as GroupChat's.
+    """
+
+    def __init__(self, prefix, chunk_size=CHUNK):
+
+        # The memory-mapped store, only read a chunk at a time
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.table = table_load(prefix)
+        self.size = len(self.table)
+
+        self.users = self.table.users
+        self.users_initials = [''.join(map(lambda x: x[0],
+                               u.split(' '))) for u in self.users]
+        self.max_len = max(len(p) for p in self.users) + 1
+
+    def chunk(self, lo, hi, text=True):
+        """
+        Messages lo to hi read into an in-memory MessageTable,
+        leaving out the texts if text=False
+        """
+        t = self.table
+        offsets = np.array(t.offsets[lo:hi + 1])
+        blob = (np.array(t.blob[offsets[0]:offsets[-1]]) if text
+                else np.zeros(0, dtype='uint8'))
+        return MessageTable(np.array(t.times[lo:hi]), np.array(t.sndrs[lo:hi]),
+                            t.users, offsets - offsets[0], blob)
+
+    def chunks(self, text=True):
+        """
+        Generator over (first message, chunk) of the whole store
+        """
+        for lo in range(0, self.size, self.chunk_size):
+            yield lo, self.chunk(lo, min(lo + self.chunk_size, self.size), text)
+
+    @cached_property
+    def span(self):
+        """
+        Earliest and latest message times, and whether the store
+        is sorted by time: 1 if oldest first, -1 if newest first,
+        0 if neither
+        """
+        t0, t1, up, down, last = None, None, True, True, None
+        for lo, c in self.chunks(text=False):
+            t = c.times.astype('int64')
+            if last is not None:
+                t = np.concatenate([[last], t])
+            gaps = np.diff(t)
+            up, down = up and bool(np.all(gaps >= 0)), down and bool(np.all(gaps <= 0))
+            t0 = c.times.min() if t0 is None else min(t0, c.times.min())
+            t1 = c.times.max() if t1 is None else max(t1, c.times.max())
+            last = t[-1]
+        return t0, t1, 1 if up else (-1 if down else 0)
+
+    def sorted_columns(self):
+        """
+        Generator over chunks of (times, sender codes) in time order,
+        with messages of the same minute in store order, as in
+        GroupChat.sorted_ix. A store sorted either way round is read
+        straight through; otherwise the order has to be found by
+        sorting the times column, the one step that needs it all
+        in memory.
+        """
+        order = self.span[2]
+        if order == 1:
+            for lo, c in self.chunks(text=False):
+                yield c.times, c.sndrs
+        elif order == -1:
+
+            # Read backwards, holding back the messages of each chunk's
+            # last minute, which the next chunk read may also have
+            held = None
+            for lo in reversed(range(0, self.size, self.chunk_size)):
+                c = self.chunk(lo, min(lo + self.chunk_size, self.size), text=False)
+                ix = np.argsort(c.times, kind='mergesort')
+                times, sndrs = c.times[ix], c.sndrs[ix]
+                if held is not None:
+                    k = np.searchsorted(times, held[0][0], side='right')
+                    times = np.concatenate([times[:k], held[0], times[k:]])
+                    sndrs = np.concatenate([sndrs[:k], held[1], sndrs[k:]])
+                j = np.searchsorted(times, times[-1])
+                held = times[j:], sndrs[j:]
+                if j:
+                    yield times[:j], sndrs[:j]
+            if held is not None:
+                yield held
+        else:
+            ix = self.table.argsort()
+            for lo in range(0, self.size, self.chunk_size):
+                j = ix[lo:lo + self.chunk_size]
+                yield self.table.times[j], self.table.sndrs[j]
+
+    @cached_property
+    def totals(self):
+        """
+        Total messages of each user
+        """
+        counts = np.zeros(len(self.users), dtype='int64')
+        for lo, c in self.chunks(text=False):
+            counts += np.bincount(c.sndrs, minlength=len(self.users))
+        return counts.astype(float)
+
+    def message_rank(self):
+        """
+        Prints the total message counts for each user
+        """
+        counts = self.totals.astype('int64')
+        rank = np.argsort(-counts, kind='mergesort')
+        percentiles = 100.0 * counts[rank] / self.size
+
+        for i, p in zip(rank, percentiles):
+            print '{name:{width}} {counts:<6} {perc:.2f}%'.format(
+                name=self.users[i], width=self.max_len, counts=counts[i], perc=p)
+
+    @cached_property
+    @timed
+    def cube(self):
+        """
+        Messages of each user on each day, summed over the chunks
+        """
+        t0, t1, _ = self.span
+        counts = 0
+        for lo, c in self.chunks(text=False):
+            counts = counts + TimeCube.build(c.times, c.sndrs, len(self.users), t0, t1).counts
+        return TimeCube(t0, t1, counts)
+
+    def time_bins(self, bin_size=1, per_user=False):
+        """
+        Messages per bin_size (in days) over the whole group chat,
+        as GroupChat.time_bins, or for every user with
+        per_user=True, shape (n_users, bins)
+        """
+        return self.cube.bins(bin_size, per_user=per_user)
+
+    @timed
+    @memoize
+    def daily_bins(self, weekday=False, per_user=False):
+        """
+        Messages over the day (or week) in 1 minute bins, as
+        GroupChat.daily_bins, or for every user with per_user=True
+        """
+        total = 0
+        for lo, c in self.chunks(text=False):
+            total = total + daily_counts(c.times, weekday,
+                                         groups=c.sndrs if per_user else None,
+                                         n_groups=len(self.users))
+        return total / 1440.0
+
+    @timed
+    @memoize
+    def conversation_matrix(self, threshold=30.0):
+        """
+        The conversation matrix of GroupChat.conversation_matrix,
+        clustering the time-sorted messages a chunk at a time. The
+        last conversation of each chunk may carry on into the next,
+        so its users are held back until it is known to be over.
+        """
+        if np.ndim(threshold):
+            return [self.conversation_matrix(t) for t in threshold]
+
+        n_users = len(self.users)
+        counts = np.zeros((n_users, n_users), dtype='int64')
+        last, held = None, np.zeros(0, dtype='int64')
+
+        for times, sndrs in self.sorted_columns():
+            minutes = times.astype('int64')
+            convs = cluster_ids(times, threshold) + 1
+
+            # The held conversation continues into this chunk unless
+            # the gap since its last message is too long
+            joined = last is not None and minutes[0] - last <= threshold
+            convs = np.concatenate([np.full(len(held), 1 if joined else 0, dtype='int64'),
+                                    convs])
+            users = np.concatenate([held, sndrs.astype('int64')])
+
+            # Count every conversation but the last, which is held back
+            c, u = incidence(convs, users, n_users)
+            done = c < c[-1]
+            counts += coparticipation(c[done], u[done], n_users)
+            held, last = u[~done], minutes[-1]
+
+        counts += coparticipation(np.zeros(len(held), dtype='int64'), held, n_users)
+        np.fill_diagonal(counts, 0)
+
+        # Normalise
+        convo_matrix = counts.astype(float)
+        convo_matrix /= self.totals[:, np.newaxis]
+        convo_matrix /= convo_matrix.sum(axis=1)[:, np.newaxis] / 100.0
+
+        return convo_matrix
+
+    @timed
+    @memoize
+    def reply_stats(self, threshold=30.0):
+        """
+        The reply counts and latencies of GroupChat.reply_stats,
+        carrying the last message of each chunk into the next
+        """
+        replies = Replies.build(np.zeros(0, dtype='datetime64[m]'), np.zeros(0, dtype='int64'),
+                                len(self.users), threshold)
+        for times, sndrs in self.sorted_columns():
+            replies = replies.extend(times, sndrs, len(self.users))
+        return replies
+
+    @timed
+    def word_find(self, words, match='substring'):
+        """
+        Times of the messages containing any of [words], as
+        GroupChat.word_find, searching the texts a chunk at a time
+        """
+        found = []
+        for lo, c in self.chunks():
+            hits = [np.arange(len(c))] if '' in words and match != 'token' else []
+            if match == 'token':
+                tokens = [set(TOKEN.findall(w.lower())) for w in words]
+                hits.append(np.array([i for i, text in enumerate(c.texts())
+                                      if any(t and t <= set(TOKEN.findall(text.lower()))
+                                             for t in tokens)], dtype='int64'))
+            else:
+                hits.extend(blob_search(c, w.encode('utf-8') if isinstance(w, unicode) else w)
+                            for w in words if w)
+            ix = np.unique(np.concatenate(hits)) if hits else np.zeros(0, dtype='int64')
+            found.append(c.times[ix])
+        return np.concatenate(found) if found else np.zeros(0, dtype='datetime64[m]')
+
+    @timed
+    @memoize
+    def message_lengths(self):
+        """
+        Number of messages of each length in words
+        """
+        counts = np.zeros((1, 1), dtype='int64')
+        for lo, c in self.chunks():
+            counts = hist_add(counts, TextStats.build(c).message_length_counts()[np.newaxis])
+        return counts[0]
+
+    @timed
+    @memoize
+    def word_lengths(self):
+        """
+        Mean and standard deviation of each user's word lengths,
+        and the mean over all users, from their summed histograms
+        """
+        hist = np.zeros((len(self.users), 1), dtype='int64')
+        for lo, c in self.chunks():
+            hist = hist_add(hist, TextStats.build(c).length_hist)
+
+        empty = np.zeros(0, dtype='int64')
+        return TextStats(empty, empty, hist).word_length_stats()
+
+    @timed
+    def report(self, workers=None):
+        """
+        Makes the plots of GroupChat.report from the chunked results
+        """
+        print 'Performing all analysis...'
+        timex, timey = self.time_bins()
+        users_t = self.time_bins(per_user=True)[1]
+        daily, users_daily = self.daily_bins(), self.daily_bins(per_user=True)
+        weekly = self.daily_bins(weekday=True)
+        means, percs, mean = self.word_lengths()
+
+        jobs = [('time_plot', {'timex': timex, 'timey': timey, 'bin_size': 1,
+                               'avg': rolling_mean(timey, 30)}),
+                ('time_plot_user', {'names': list(self.users), 'bin_size': 1,
+                                    'times': [timex] * len(self.users),
+                                    'avgs': list(rolling_mean(users_t, 30))}),
+                ('matrix_plot', {'convo_matrix': self.conversation_matrix(),
+                                 'initials': self.users_initials}),
+                ('daily_plot', {'title': 'All-User Daily Activity', 'raw': daily,
+                                'avgs': [moving_average(daily, 60)]}),
+                ('daily_plot', {'title': '%d-User Daily Activity' % len(self.users),
+                                'names': list(self.users),
+                                'avgs': [moving_average(d, 60) for d in users_daily]}),
+                ('weekly_plot', {'avg': np.array([moving_average(d, 60) for d in weekly])}),
+                ('message_length_plot', {'counts': self.message_lengths()}),
+                ('word_length_plot', {'users': self.users, 'means': means,
+                                      'percs': percs, 'mean': mean})]
+
+        print 'Rendering %d plots...' % len(jobs)
+        renderer().batch(jobs, workers)
@@ -0,0 +1,80 @@
+"""
+Queries the chats held by a running tools/server.py, in place of
+loading a GroupChat in each script:
+
+    from tools.client import ChatClient
+    chat = ChatClient()
+    chat.message_rank()
+    times = chat.word_find(['pub'])
+"""
+import json
+import urllib2
+from io import BytesIO
+from tools import results
+
+# Port the server listens on by default
+PORT = 8017
+
+
+class ChatClient:
+    """
+    One chat of the server (its first by default), with its
+    queries as methods returning the same arrays as GroupChat
+    """
+
+    def __init__(self, chat=None, host='localhost', port=PORT):
+        self.chat = chat
+        self.url = 'http://%s:%d' % (host, port)
+
+    def request(self, path, body=None):
+        """
+        Response to a GET (or a POST of body) at path
+        """
+        req = urllib2.Request(self.url + path, body,
+                              {'Content-Type': 'application/json'} if body else {})
+        try:
+            return urllib2.urlopen(req).read()
+        except urllib2.HTTPError as e:
+            raise ValueError(json.loads(e.read())['error'])
+
+    def query(self, query, **args):
+        """
+        Runs a query on the chat, returning its result
+        """
+        body = json.dumps({'chat': self.chat, 'query': query,
+                           'args': args, 'format': 'npz'})
+        return results.load(BytesIO(self.request('/query', body)))
+
+    def chats(self):
+        """
+        Names and sizes of the server's chats
+        """
+        return json.loads(self.request('/chats'))
+
+    def users(self):
+        return self.query('users')
+
+    def message_rank(self):
+        """
+        Users and their total message counts, most first
+        """
+        return self.query('message_rank')
+
+    def word_find(self, words, match='substring'):
+        return self.query('word_find', words=words, match=match)
+
+    def time_bins(self, bin_size=1, users=None):
+        return self.query('time_bins', bin_size=bin_size, users=users)
+
+    def daily_bins(self, weekday=False, per_user=False):
+        return self.query('daily_bins', weekday=weekday, per_user=per_user)
+
+    def conversation_matrix(self, threshold=30.0):
+        return self.query('conversation_matrix', threshold=threshold)
+
+    def replies(self, threshold=30.0, q=(50,)):
+        """
+        Reply counts and latency percentiles of each pair of
+        users, and each user's turns and messages
+        """
+        return self.query('replies', threshold=threshold, q=list(q))
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def cluster_ids(times, threshold=30.0):
+    """
+    Conversation number of each message in a time-sorted datetime64[m]
+    array. A new conversation starts wherever the gap to the previous
+    message is longer than threshold minutes. If threshold is a list,
+    returns one array per threshold, sharing the gap calculation.
+    """
+    gaps = np.diff(np.asarray(times, dtype='datetime64[m]').astype('int64'))
+
+    def ids(t):
+        out = np.zeros(len(times), dtype='int64')
+        np.cumsum(gaps > t, out=out[1:])
+        return out
+
+    if np.ndim(threshold):
+        return [ids(t) for t in threshold]
+    return ids(threshold)
+
+
+def incidence(convs, sndrs, n_users):
+    """
+    Sparse conversation x user incidence matrix, as the sorted unique
+    (conversation, user) pairs of each message
+    """
+    keys = np.unique(np.asarray(convs, dtype='int64') * n_users + sndrs)
+    return keys // n_users, keys % n_users
+
+
+def coparticipation(convs, users, n_users):
+    """
+    The product of the incidence matrix (given as sorted pairs from
+    incidence) with its own transpose: entry [i, j] is the number of
+    conversations users i and j both took part in.
+    """
+    rows, cols = copairs(convs)
+    users = np.asarray(users)
+
+    counts = np.bincount(users[rows] * n_users + users[cols], minlength=n_users ** 2)
+    return counts.reshape(n_users, n_users)
+
+
+def copairs(convs):
+    """
+    Pairs every entry of a sorted array of conversation numbers with
+    every entry of the same conversation, as two arrays of positions
+    """
+    convs = np.asarray(convs)
+    starts = np.searchsorted(convs, convs, side='left')
+    sizes = np.searchsorted(convs, convs, side='right') - starts
+    rows = np.repeat(np.arange(len(convs)), sizes)
+    cols = np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(len(rows))
+    return rows, cols
+
+
+def conversation_counts(times, sndrs, n_users, threshold=30.0):
+    """
+    Number of conversations shared by each pair of users (zero on
+    the diagonal), from time-sorted times and sender codes
+    """
+    counts = coparticipation(*incidence(cluster_ids(times, threshold),
+                                        sndrs, n_users), n_users=n_users)
+    np.fill_diagonal(counts, 0)
+    return counts
@@ -0,0 +1,322 @@
+import os
+import json
+import numpy as np
+from collections import OrderedDict
+from tools.table import MessageTable
+from tools.store import table_save, table_load, array_save, store_paths
+from tools.parse import iter_messages
+from tools.cluster import cluster_ids, incidence, copairs
+from tools.bins import daily_counts
+from tools.index import blob_search
+from tools.lazy import cached_property, memoize
+from tools.chat import GroupChat
+from tools.instrument import timed
+
+
+class ChatCorpus:
+    """
+    Many group chats held together in one columnar store: a single
+    MessageTable of all their messages, sorted by chat and then by
+    time, whose sender codes index one user dictionary shared by
+    every chat, plus a column giving each message's chat number.
+    Each chat is a contiguous block of the table, and the analyses
+    are run over all the chats (or any subset of them) at once.
+    """
+
+    def __init__(self, table, chats, names, prefix=None):
+
+        # All the messages, and the chat number of each
+        self.table = table
+        self.chats = chats
+        self.names = names
+        self.prefix = prefix
+        self.size = len(table)
+
+        # The global user dictionary
+        self.users = table.users
+
+        # Messages of chat k are bounds[k]:bounds[k + 1]
+        self.bounds = np.searchsorted(chats, np.arange(len(names) + 1))
+
+    @classmethod
+    def from_tables(cls, names, tables):
+        """
+        Builds a corpus from one MessageTable per chat, leaving
+        out any with no messages
+        """
+        names, tables = zip(*[(n, t.take(t.argsort()))
+                              for n, t in zip(names, tables) if len(t)]) or ([], [])
+        chats = np.repeat(np.arange(len(tables)), [len(t) for t in tables])
+        return cls(MessageTable.concat(tables), chats.astype('int32'), list(names))
+
+    @classmethod
+    def from_stores(cls, prefixes):
+        """
+        Builds a corpus from the message stores of single chats,
+        each named after its store
+        """
+        return cls.from_tables([os.path.basename(p) for p in prefixes],
+                               [table_load(p) for p in prefixes])
+
+    @classmethod
+    def parse(cls, file_paths):
+        """
+        Parses every thread of every HTML file given as one chat,
+        named after its file and thread number
+        """
+        threads = OrderedDict()
+        for file_path in file_paths:
+            print 'Streaming every thread from %s' % file_path.split('/')[-1]
+            for n, m in iter_messages(file_path, thread=None, numbered=True):
+                threads.setdefault('%s:%d' % (os.path.basename(file_path), n), []).append(m)
+
+        print 'Found %d chats' % len(threads)
+        return cls.from_tables(threads.keys(),
+                               [MessageTable.from_records(t) for t in threads.values()])
+
+    def save(self, prefix):
+        """
+        Writes the corpus to a message store at prefix, with the
+        chat column and names alongside
+        """
+        header = store_paths(prefix)['header']
+        if os.path.exists(header):
+            os.remove(header)
+
+        array_save(prefix + '.chats.npy', np.asarray(self.chats, dtype='int32'))
+        with open(prefix + '.chats.json', 'w') as f:
+            json.dump(self.names, f)
+        table_save(self.table, prefix)
+        self.prefix = prefix
+
+    def select(self, chats=None):
+        """
+        Numbers of the given chats (by name or number), all by default
+        """
+        if chats is None:
+            return np.arange(len(self.names))
+        return np.array([self.names.index(c) if isinstance(c, basestring) else c
+                         for c in chats], dtype='int64')
+
+    def messages(self, sel):
+        """
+        Indices of the messages of the chats numbered in sel, and
+        the position in sel of each message's chat
+        """
+        lo, lengths = self.bounds[sel], self.bounds[sel + 1] - self.bounds[sel]
+        group = np.repeat(np.arange(len(sel)), lengths)
+        ix = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        return ix, group
+
+    @cached_property
+    def local(self):
+        """
+        The users of each chat, as global codes in order of their
+        first message (chat k's are users[offsets[k]:offsets[k + 1]]),
+        and each message's sender code within its own chat
+        """
+        n = len(self.users)
+        keys = np.asarray(self.chats, dtype='int64') * n + self.table.sndrs
+        uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        # Rank each chat's users by their first message
+        order = np.lexsort((first, uniq // n))
+        rank = np.empty(len(order), dtype='int64')
+        rank[order] = np.arange(len(order))
+
+        offsets = np.zeros(len(self.names) + 1, dtype='int64')
+        np.cumsum(np.bincount(uniq // n, minlength=len(self.names)), out=offsets[1:])
+        codes = rank[inverse] - offsets[self.chats]
+
+        return (uniq % n)[order], offsets, codes
+
+    def chat_users(self, chat):
+        """
+        Names of the users of one chat, in the order of its results
+        """
+        users, offsets, _ = self.local
+        k = self.select([chat])[0]
+        return [self.users[u] for u in users[offsets[k]:offsets[k + 1]]]
+
+    def chat_table(self, chat):
+        """
+        The messages of one chat as its own MessageTable
+        """
+        k = self.select([chat])[0]
+        lo, hi = self.bounds[k], self.bounds[k + 1]
+        t = self.table.take(np.arange(lo, hi))
+        return MessageTable(t.times, self.local[2][lo:hi].astype('int32'),
+                            self.chat_users(k), t.offsets, t.blob)
+
+    def chat(self, chat):
+        """
+        One chat as a GroupChat, for the analyses only it has
+        """
+        return GroupChat(self.chat_table(chat))
+
+    @cached_property
+    def totals(self):
+        """
+        Total messages of each user of each chat, flattened
+        in the same way as the users of local
+        """
+        users, offsets, codes = self.local
+        return np.bincount(offsets[self.chats] + codes,
+                           minlength=len(users)).astype(float)
+
+    @timed
+    def message_counts(self, chats=None):
+        """
+        Messages of every user (in the global dictionary) in each
+        chat, shape (chats, users)
+        """
+        sel = self.select(chats)
+        ix, group = self.messages(sel)
+        n = len(self.users)
+        counts = np.bincount(group * n + self.table.sndrs[ix], minlength=len(sel) * n)
+        return counts.reshape(len(sel), n)
+
+    def message_rank(self, chats=None):
+        """
+        Prints the total message counts for each user of each chat
+        """
+        users, offsets, _ = self.local
+        width = max(len(p) for p in self.users) + 1
+        for k in self.select(chats):
+            counts = self.totals[offsets[k]:offsets[k + 1]].astype('int64')
+            rank = np.argsort(-counts, kind='mergesort')
+            size = self.bounds[k + 1] - self.bounds[k]
+
+            print self.names[k]
+            for i in rank:
+                print '{name:{width}} {counts:<6} {perc:.2f}%'.format(
+                    name=self.users[users[offsets[k] + i]], width=width,
+                    counts=counts[i], perc=100.0 * counts[i] / size)
+
+    @timed
+    @memoize
+    def time_bins(self, chats=None, bin_size=1):
+        """
+        The messages per bin_size (in days) of GroupChat.time_bins for
+        each chat, over its own lifetime, as a list of (dates, counts)
+        """
+        sel = self.select(chats)
+        ix, group = self.messages(sel)
+        times = self.table.times[ix]
+
+        # Each chat's messages are in time order
+        t0 = self.table.times[self.bounds[sel]]
+        t1 = self.table.times[self.bounds[sel + 1] - 1]
+        all_days = (t1 - t0).astype('timedelta64[D]').astype('int64')
+
+        # np.histogram over edges 1, 1 + bin_size, ... up to all_days + 2,
+        # the last bin including its right edge
+        n_bins = (all_days + 1) // bin_size
+        last = 1 + bin_size * n_bins
+        base = np.cumsum(n_bins) - n_bins
+        days = (times - t0[group]).astype('timedelta64[D]').astype('int64')
+        b = np.minimum((days - 1) // bin_size, n_bins[group] - 1)
+        inside = (days >= 1) & (days <= last[group]) & (b >= 0)
+        counts = np.bincount(base[group[inside]] + b[inside], minlength=n_bins.sum())
+
+        result = []
+        for k in range(len(sel)):
+            time = np.arange(t0[k], t1[k], bin_size, dtype='datetime64[D]')
+            result.append((time, counts[base[k]:base[k] + n_bins[k]][:len(time)]))
+        return result
+
+    @timed
+    @memoize
+    def daily_bins(self, chats=None, weekday=False):
+        """
+        Messages over the day (or the week with weekday=True) of
+        each chat in 1 minute bins, shape (chats, ...)
+        """
+        sel = self.select(chats)
+        ix, group = self.messages(sel)
+        return daily_counts(self.table.times[ix], weekday, groups=group,
+                            n_groups=len(sel)) / 1440.0
+
+    @timed
+    @memoize
+    def conversation_matrix(self, chats=None, threshold=30.0):
+        """
+        The conversation matrix of GroupChat.conversation_matrix for
+        each chat, as a list of arrays over the users of each chat
+        (see chat_users), from one clustering of all their messages
+        """
+        sel = self.select(chats)
+        ix, group = self.messages(sel)
+        users, offsets, codes = self.local
+
+        # Conversations never run from one chat into the next
+        convs = cluster_ids(self.table.times[ix], threshold)
+        convs[1:] += np.cumsum(group[1:] != group[:-1])
+
+        # Number the users of all the selected chats together
+        sizes = offsets[sel + 1] - offsets[sel]
+        user_base = np.cumsum(sizes) - sizes
+        user_chat = np.repeat(np.arange(len(sel)), sizes)
+        convs, members = incidence(convs, user_base[group] + codes[ix], sizes.sum())
+
+        # Count the pairs of users sharing each conversation
+        # into a block of counts for each chat
+        rows, cols = copairs(convs)
+        g = user_chat[members[rows]]
+        block = np.cumsum(sizes ** 2) - sizes ** 2
+        keys = (block[g] + (members[rows] - user_base[g]) * sizes[g] +
+                members[cols] - user_base[g])
+        counts = np.bincount(keys, minlength=(sizes ** 2).sum())
+
+        result = []
+        for k, c in enumerate(sel):
+            convo_matrix = counts[block[k]:block[k] + sizes[k] ** 2].reshape(
+                sizes[k], sizes[k]).astype(float)
+            np.fill_diagonal(convo_matrix, 0)
+
+            # Normalise
+            convo_matrix /= self.totals[offsets[c]:offsets[c + 1], np.newaxis]
+            convo_matrix /= convo_matrix.sum(axis=1)[:, np.newaxis] / 100.0
+            result.append(convo_matrix)
+        return result
+
+    @timed
+    def word_find(self, words, chats=None):
+        """
+        Times of the messages containing any of [words] in each
+        chat, from one search of the whole text buffer
+        """
+        sel = self.select(chats)
+        hits = [blob_search(self.table, w.encode('utf-8') if isinstance(w, unicode) else w)
+                for w in words if w]
+        if '' in words:
+            hits.append(np.arange(self.size))
+        ix = np.unique(np.concatenate(hits)) if hits else np.zeros(0, dtype='int64')
+
+        chat = np.asarray(self.chats)[ix]
+        return [self.table.times[ix[chat == k]] for k in sel]
+
+    def summary(self, chats=None):
+        """
+        Prints the size, users and lifetime of each chat
+        """
+        users, offsets, _ = self.local
+        width = max(len(n) for n in self.names) + 1
+        for k in self.select(chats):
+            lo, hi = self.bounds[k], self.bounds[k + 1]
+            print '{name:{width}} {size:>8} msgs {users:>4} users {t0} - {t1}'.format(
+                name=self.names[k], width=width, size=hi - lo,
+                users=offsets[k + 1] - offsets[k],
+                t0=self.table.times[lo].astype('datetime64[D]'),
+                t1=self.table.times[hi - 1].astype('datetime64[D]'))
+
+
+def corpus_load(prefix, mmap=True):
+    """
+    Opens the corpus store at prefix, memory-mapped by default
+    """
+    with open(prefix + '.chats.json') as f:
+        names = json.load(f)
+    return ChatCorpus(table_load(prefix, mmap),
+                      np.load(prefix + '.chats.npy', mmap_mode='r' if mmap else None),
+                      names, prefix)
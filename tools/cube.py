@@ -0,0 +1,87 @@
+import numpy as np
+
+
+def day_offsets(times, t0):
+    """
+    Whole days from t0 to each time, as GroupChat.time_bins counts them
+    """
+    return (np.asarray(times, dtype='datetime64[m]') - t0).astype(
+        'timedelta64[D]').astype('int64')
+
+
+class TimeCube:
+    """
+    Messages of each user on each day of a chat, counted once, with
+    their running sums along the days. Days are whole days from the
+    first message, as in GroupChat.time_bins, so the counts of any
+    bin size, for any subset of users, are differences of the running
+    sums at the bin edges, with no need to bin the times again.
+    """
+
+    def __init__(self, t0, t1, counts):
+
+        # First and last message times of the chat
+        self.t0, self.t1 = t0, t1
+
+        # counts[u, d] is the number of messages of user u on day d
+        self.counts = counts
+
+        # prefix[u, d] is the number of messages of user u before day d,
+        # and total the same over all users
+        self.prefix = np.zeros((counts.shape[0], counts.shape[1] + 1), dtype='int64')
+        np.cumsum(counts, axis=1, out=self.prefix[:, 1:])
+        self.total = self.prefix.sum(axis=0)
+
+    @classmethod
+    def build(cls, times, sndrs, n_users, t0=None, t1=None):
+        """
+        Counts messages by sender code and day, over the days from
+        t0 to t1 (those of the times by default); any times outside
+        them are left out
+        """
+        times = np.asarray(times, dtype='datetime64[m]')
+        t0 = times.min() if t0 is None else t0
+        t1 = times.max() if t1 is None else t1
+        n_days = int(day_offsets(t1, t0)) + 1
+
+        days = day_offsets(times, t0)
+        inside = (days >= 0) & (days < n_days)
+        cell = np.asarray(sndrs, dtype='int64')[inside] * n_days + days[inside]
+        counts = np.bincount(cell, minlength=n_users * n_days)
+        return cls(t0, t1, counts.reshape(n_users, n_days))
+
+    def extend(self, times, sndrs, n_users):
+        """
+        Adds messages no older than the first, which may
+        come after the last and be from new users
+        """
+        t1 = max(self.t1, np.asarray(times, dtype='datetime64[m]').max())
+        new = TimeCube.build(times, sndrs, n_users, self.t0, t1)
+        counts = new.counts.copy()
+        counts[:self.counts.shape[0], :self.counts.shape[1]] += self.counts
+        return TimeCube(self.t0, t1, counts)
+
+    def bins(self, bin_size=1, users=None, per_user=False):
+        """
+        Messages per bin_size days, as GroupChat.time_bins: the dates
+        of the bins and the counts of all users, or of the given user
+        codes, summed or one row each with per_user=True
+        """
+        if users is None and not per_user:
+            prefix = self.total
+        else:
+            prefix = self.prefix if users is None else self.prefix[users]
+            if not per_user:
+                prefix = prefix.sum(axis=0)
+
+        # Bins run from day 1 in steps of bin_size, half-open but
+        # the last, which also takes the day on its right edge
+        n_days = self.counts.shape[1]
+        n_bins = n_days // bin_size
+        lo = 1 + bin_size * np.arange(n_bins)
+        hi = lo + bin_size
+        hi[-1:] += 1
+        counts = prefix[..., np.minimum(hi, n_days)] - prefix[..., np.minimum(lo, n_days)]
+
+        time = np.arange(self.t0, self.t1, bin_size, dtype='datetime64[D]')
+        return time, counts[..., :len(time)]
@@ -0,0 +1,396 @@
+import os
+import re
+import json
+import numpy as np
+from bisect import bisect_left
+from tools.store import array_save
+
+# Bump whenever the layout of the index files changes
+INDEX_VERSION = 2
+
+# Bytes of text handled at once when building the trigram index
+BLOCK = 1 << 24
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+class Vocabulary:
+    """
+    A sorted list of distinct words, kept as one UTF-8 buffer with
+    offsets into it like the message texts (word i is the bytes
+    blob[offsets[i]:offsets[i + 1]]), so its size is that of the
+    words themselves however long the longest one is
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_words(cls, words):
+        """
+        Builds the vocabulary of a sorted list of UTF-8 words
+        """
+        lengths = np.array([len(w) for w in words], dtype='int64')
+        return cls(np.concatenate([[0], np.cumsum(lengths)]).astype('int64'),
+                   np.frombuffer(''.join(words), dtype='uint8'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tostring()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def find(self, word):
+        """
+        Number of the UTF-8 word, or -1 if it is not in the vocabulary
+        """
+        i = bisect_left(self, word)
+        return i if i < len(self) and self[i] == word else -1
+
+
+class Postings:
+    """
+    Maps each term to the sorted indices of the messages containing
+    it, stored as a sorted array of integer terms with offsets into
+    one array of message indices (terms[i] is in messages
+    ids[offsets[i]:offsets[i + 1]]).
+    """
+
+    def __init__(self, terms, offsets, ids):
+        self.terms = terms
+        self.offsets = offsets
+        self.ids = ids
+
+    @classmethod
+    def from_pairs(cls, terms, ids):
+        """
+        Builds the postings from parallel arrays of (term, message) pairs
+        """
+        order = np.lexsort((ids, terms))
+        terms, ids = terms[order], ids[order]
+
+        # Drop repeated pairs
+        keep = np.ones(len(ids), dtype=bool)
+        keep[1:] = (terms[1:] != terms[:-1]) | (ids[1:] != ids[:-1])
+        terms, ids = terms[keep], ids[keep]
+
+        # One entry per distinct term
+        first = np.ones(len(terms), dtype=bool)
+        first[1:] = terms[1:] != terms[:-1]
+        starts = np.nonzero(first)[0]
+        return cls(terms[starts].astype('int32'), np.append(starts, len(ids)).astype('int64'),
+                   ids.astype('int32'))
+
+    def pairs(self):
+        """
+        The (term, message) pairs the postings were built from
+        """
+        return np.repeat(self.terms, np.diff(self.offsets)), self.ids
+
+    def merge(self, other):
+        """
+        Postings of both sets of pairs together
+        """
+        a, b = self.pairs(), other.pairs()
+        return Postings.from_pairs(np.concatenate([a[0], b[0]]),
+                                   np.concatenate([a[1], b[1]]))
+
+    def lookup(self, term):
+        """
+        Sorted indices of the messages containing term
+        """
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return np.zeros(0, dtype='int64')
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+
+class TextIndex:
+    """
+    Inverted indexes over the texts of a MessageTable, built once
+    and stored alongside the message store:
+    a token index of lower case words (numbered by their place in
+    the vocabulary), for whole word searches, and an index of UTF-8
+    byte trigrams, which narrows a substring search down to the few
+    messages that could contain it.
+    """
+
+    def __init__(self, size, words, tokens, grams):
+        self.size = size
+        self.words = words
+        self.tokens = tokens
+        self.grams = grams
+
+    @classmethod
+    def build(cls, table, start=0):
+        """
+        Indexes the texts of messages start onwards of the table
+        """
+        n = len(table)
+
+        # Word tokens, one pass over the decoded texts, numbering
+        # each distinct word as it is first seen
+        vocab, terms, ids = {}, [], []
+        for i, text in enumerate(table.texts(range(start, n))):
+            words = set(TOKEN.findall(text.lower()))
+            terms.extend([vocab.setdefault(w, len(vocab)) for w in words])
+            ids.extend([start + i] * len(words))
+
+        # Renumber the words in sorted order of their UTF-8 bytes
+        encoded = [w.encode('utf-8') for w in sorted(vocab, key=vocab.get)]
+        order = sorted(range(len(encoded)), key=encoded.__getitem__)
+        rank = np.empty(len(order), dtype='int64')
+        rank[order] = np.arange(len(order))
+        words = Vocabulary.from_words([encoded[k] for k in order])
+        tokens = Postings.from_pairs(rank[np.array(terms, dtype='int64')],
+                                     np.array(ids, dtype='int64'))
+
+        # Byte trigrams straight from the text buffer, in blocks
+        keys, lo = [], start
+        while lo < n:
+            hi = max(lo + 1, np.searchsorted(table.offsets, table.offsets[lo] + BLOCK) - 1)
+            hi = min(hi, n)
+            keys.append(trigram_keys(table, lo, hi))
+            lo = hi
+        keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype='int64')
+        grams = Postings.from_pairs(keys // max(n, 1), keys % max(n, 1))
+
+        return cls(n, words, tokens, grams)
+
+    def extend(self, table):
+        """
+        Index of the table, given this index covers its first
+        self.size messages
+        """
+        new = TextIndex.build(table, self.size)
+
+        # Number the words of both in one vocabulary
+        words = sorted(set(self.words) | set(new.words))
+        place = dict((w, i) for i, w in enumerate(words))
+        old_terms, old_ids = self.tokens.pairs()
+        new_terms, new_ids = new.tokens.pairs()
+        tokens = Postings.from_pairs(
+            np.concatenate([np.array([place[w] for w in self.words], dtype='int64')[old_terms],
+                            np.array([place[w] for w in new.words], dtype='int64')[new_terms]]),
+            np.concatenate([old_ids, new_ids]))
+
+        return TextIndex(len(table), Vocabulary.from_words(words), tokens,
+                         self.grams.merge(new.grams))
+
+    def find(self, words, table, match='substring'):
+        """
+        Sorted indices of the messages containing any of [words].
+        With match='substring' a word matches anywhere in the text,
+        exactly as `word in text`; with match='token' it must match
+        whole words, ignoring case.
+        """
+        hits = [self.token_find(w) if match == 'token' else
+                self.substring_find(w, table) for w in words]
+        if not hits:
+            return np.zeros(0, dtype='int64')
+        return np.unique(np.concatenate(hits))
+
+    def token_find(self, word):
+        """
+        Messages containing every word token of word
+        """
+        ids = None
+        for t in TOKEN.findall(word.lower()):
+            found = self.tokens.lookup(self.words.find(t.encode('utf-8')))
+            ids = found if ids is None else np.intersect1d(ids, found)
+        return np.zeros(0, dtype='int64') if ids is None else ids
+
+    def substring_find(self, word, table):
+        """
+        Messages containing word anywhere in their text
+        """
+        b = word.encode('utf-8') if isinstance(word, unicode) else word
+
+        # Too short to have a trigram, check every message
+        if not b:
+            return np.arange(self.size)
+        elif len(b) < 3:
+            candidates = np.arange(self.size)
+        else:
+            codes = np.unique(trigram_codes(np.frombuffer(b, dtype='uint8')))
+            found = sorted((self.grams.lookup(c) for c in codes), key=len)
+            candidates = reduce(np.intersect1d, found)
+
+        # UTF-8 substrings match exactly where the decoded strings do,
+        # so check the candidates' bytes, or scan the whole buffer
+        # once if most messages are candidates
+        if len(candidates) > self.size // 8:
+            return blob_search(table, b)
+        return np.array([i for i in candidates
+                         if b in table.blob[table.offsets[i]:table.offsets[i + 1]].tostring()],
+                        dtype='int64')
+
+
+def blob_search(table, b):
+    """
+    Sorted indices of the messages containing the bytes b, found in
+    one pass over the whole text buffer
+    """
+    # A lookahead finds overlapping matches too
+    pattern = re.compile('(?=%s)' % re.escape(b))
+    pos = np.fromiter((m.start() for m in pattern.finditer(
+        buffer(table.blob), table.offsets[0], table.offsets[-1])), dtype='int64')
+
+    # Keep the matches lying inside one message
+    msg = np.searchsorted(table.offsets, pos, side='right') - 1
+    inside = pos + len(b) <= table.offsets[msg + 1]
+
+    return np.unique(msg[inside])
+
+
+def multi_search(table, groups):
+    """
+    Finds the messages containing any of the words of each group in
+    [groups] (a list of lists of words) with a single pass over the
+    text buffer. Returns the (message, group) hits as two arrays,
+    sorted by message.
+    """
+    groups = [[w.encode('utf-8') if isinstance(w, unicode) else w for w in g]
+              for g in groups]
+    n_groups = max(len(groups), 1)
+
+    # Longest first, so the match at each position is the longest one
+    words = sorted(set(w for g in groups for w in g if w), key=len, reverse=True)
+    lengths = np.array([len(w) for w in words], dtype='int64')
+
+    # A match of a word is a match of every word inside it too, so
+    # list the groups each word implies (flattened, with offsets)
+    implied = [[k for k, g in enumerate(groups) if any(v and v in w for v in g)]
+               for w in words]
+    implied_offsets = np.cumsum([0] + [len(k) for k in implied])
+    implied = np.array([k for ks in implied for k in ks], dtype='int64')
+
+    # One pass of a lookahead alternation, finding overlapping matches
+    pos, which = np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+    if words:
+        word_ix = dict((w, i) for i, w in enumerate(words))
+        pattern = re.compile('(?=(%s))' % '|'.join(re.escape(w) for w in words))
+        buf = buffer(table.blob)
+        found = np.array([(m.start(), word_ix[m.group(1)]) for m in pattern.finditer(
+            buf, table.offsets[0], table.offsets[-1])], dtype='int64').reshape(-1, 2)
+        pos, which = found[:, 0], found[:, 1]
+
+    msgs = np.searchsorted(table.offsets, pos, side='right') - 1
+    ends = table.offsets[msgs + 1]
+    inside = pos + lengths[which] <= ends
+
+    # A match running into the next message may still start with
+    # a shorter word lying inside this one
+    for i in np.nonzero(~inside)[0]:
+        rest = buf[pos[i]:ends[i]]
+        for j in range(which[i] + 1, len(words)):
+            if rest.startswith(words[j]):
+                which[i], inside[i] = j, True
+                break
+    msgs, which = msgs[inside], which[inside]
+
+    # Expand each word hit to the groups it implies
+    counts = implied_offsets[which + 1] - implied_offsets[which]
+    first = np.repeat(implied_offsets[which] - (np.cumsum(counts) - counts), counts)
+    hits = implied[first + np.arange(counts.sum())]
+    msgs = np.repeat(msgs, counts)
+
+    # An empty word matches every message
+    for k, g in enumerate(groups):
+        if '' in g:
+            msgs = np.append(msgs, np.arange(len(table)))
+            hits = np.append(hits, np.full(len(table), k, dtype='int64'))
+
+    keys = np.unique(msgs * n_groups + hits)
+    return keys // n_groups, keys % n_groups
+
+
+def trigram_codes(buf):
+    """
+    Integer code of the three bytes starting at each position of buf
+    """
+    buf = buf.astype('int64')
+    return (buf[:-2] << 16) | (buf[1:-1] << 8) | buf[2:]
+
+
+def trigram_keys(table, lo, hi):
+    """
+    Unique (trigram code * len(table) + message) keys of messages lo to hi
+    """
+    n = max(len(table), 1)
+    base = table.offsets[lo]
+    buf = np.asarray(table.blob[base:table.offsets[hi]])
+    if len(buf) < 3:
+        return np.zeros(0, dtype='int64')
+
+    # Message of each trigram, keeping only those inside one message
+    pos = np.arange(len(buf) - 2) + base
+    msg = np.searchsorted(table.offsets[lo:hi + 1], pos, side='right') - 1 + lo
+    inside = pos + 3 <= table.offsets[msg + 1]
+
+    return np.unique(trigram_codes(buf)[inside] * n + msg[inside])
+
+
+def index_paths(prefix):
+    """
+    Files making up the text index of the store at prefix:
+    a JSON header and one .npy file per array
+    """
+    paths = dict((name, '%s.index.%s.npy' % (prefix, name)) for name in
+                 ('word_offsets', 'word_blob', 'token_terms', 'token_offsets',
+                  'token_ids', 'gram_terms', 'gram_offsets', 'gram_ids'))
+    paths['header'] = prefix + '.index.json'
+    return paths
+
+
+def index_save(index, prefix):
+    """
+    Saves a TextIndex next to the message store at prefix
+    """
+    paths = index_paths(prefix)
+
+    # Remove the old header first so a half-written index is never loaded
+    if os.path.exists(paths['header']):
+        os.remove(paths['header'])
+
+    for name, postings in (('token', index.tokens), ('gram', index.grams)):
+        array_save(paths[name + '_terms'], postings.terms)
+        array_save(paths[name + '_offsets'], postings.offsets)
+        array_save(paths[name + '_ids'], postings.ids)
+    array_save(paths['word_offsets'], index.words.offsets)
+    array_save(paths['word_blob'], index.words.blob)
+
+    with open(paths['header'], 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'size': index.size}, f)
+
+    # The single file of older versions is no longer read
+    if os.path.exists(prefix + '.index.npz'):
+        os.remove(prefix + '.index.npz')
+
+
+def index_load(prefix, size=None):
+    """
+    Opens the TextIndex saved with the store at prefix over memory
+    maps of its files, or returns None if there is none of the
+    current version (or covering a different number of messages
+    than size)
+    """
+    paths = index_paths(prefix)
+    try:
+        with open(paths['header']) as f:
+            header = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if header.get('version') != INDEX_VERSION or (size is not None and header['size'] != size):
+        return None
+
+    a = dict((name, np.load(path, mmap_mode='r'))
+             for name, path in paths.items() if name != 'header')
+    return TextIndex(header['size'], Vocabulary(a['word_offsets'], a['word_blob']),
+                     Postings(a['token_terms'], a['token_offsets'], a['token_ids']),
+                     Postings(a['gram_terms'], a['gram_offsets'], a['gram_ids']))
@@ -0,0 +1,158 @@
+"""
+Records the wall time, CPU time, memory and item count of each
+stage of a run. Off unless switched on with the -profile flag of
+main.py or the FB_PROFILE environment variable, e.g.
+
+    python main.py export.htm -all -profile
+    python main.py -all -profile=run.json
+    FB_PROFILE=run.trace.json python main.py -all
+
+A summary table is printed at the end of the run. If a file is
+given the records are also written there, as a Chrome trace
+(open in chrome://tracing) if its name ends in .trace.json,
+otherwise as a plain JSON list.
+"""
+import os
+import json
+import resource
+from time import time
+from functools import wraps
+from contextlib import contextmanager
+
+# Whether stages are being recorded, and where to write them
+ENABLED = bool(os.environ.get('FB_PROFILE'))
+OUTPUT = os.environ.get('FB_PROFILE') if ENABLED and os.environ['FB_PROFILE'] != '1' else None
+
+# Every finished stage, in order of finishing
+records = []
+
+# Names of the stages currently running, outermost first
+_open = []
+
+
+def configure(argv):
+    """
+    Switches recording on if argv has a -profile[=file] flag
+    """
+    global ENABLED, OUTPUT
+    for a in argv:
+        if a == '-profile' or a.startswith('-profile='):
+            ENABLED = True
+            OUTPUT = a.partition('=')[2] or OUTPUT
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process so far in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def cpu_time():
+    """
+    User plus system CPU time of this process in seconds
+    """
+    t = os.times()
+    return t[0] + t[1]
+
+
+@contextmanager
+def stage(name, items=None):
+    """
+    Records the stage run inside the with block. Yields the record,
+    so an item count found along the way can be set on it as
+    record['items'] = n. The peak memory is the process's peak at
+    the end of the stage, peak_growth how much the stage raised it.
+    """
+    if not ENABLED:
+        yield {}
+        return
+
+    rec = {'name': name, 'items': items, 'depth': len(_open),
+           'pid': os.getpid(), 'start': time()}
+    peak, cpu = peak_rss(), cpu_time()
+    _open.append(name)
+    try:
+        yield rec
+    finally:
+        _open.pop()
+        rec['wall'] = time() - rec['start']
+        rec['cpu'] = cpu_time() - cpu
+        rec['peak_rss'] = peak_rss()
+        rec['peak_growth'] = rec['peak_rss'] - peak
+        records.append(rec)
+
+
+def timed(func):
+    """
+    Records each call of func as a stage, counting the
+    items of its result if it has a length
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        with stage(func.__name__) as rec:
+            result = func(*args, **kwargs)
+            if hasattr(result, '__len__'):
+                rec['items'] = len(result)
+        return result
+
+    return wrapper
+
+
+def summary():
+    """
+    Prints one line per stage name, totalled over its calls
+    and in the order the stages first started
+    """
+    totals = {}
+    for r in sorted(records, key=lambda r: r['start']):
+        t = totals.setdefault(r['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                          'peak_rss': 0.0, 'items': None,
+                                          'depth': r['depth'], 'start': r['start']})
+        t['calls'] += 1
+        t['wall'] += r['wall']
+        t['cpu'] += r['cpu']
+        t['peak_rss'] = max(t['peak_rss'], r['peak_rss'])
+        if r['items'] is not None:
+            t['items'] = (t['items'] or 0) + r['items']
+
+    print '{0:32} {1:>6} {2:>9} {3:>9} {4:>10} {5:>10}'.format(
+        'Stage', 'Calls', 'Wall (s)', 'CPU (s)', 'Peak (MB)', 'Items')
+    for name, t in sorted(totals.items(), key=lambda x: x[1]['start']):
+        print '{0:32} {1:>6} {2:>9.3f} {3:>9.3f} {4:>10.1f} {5:>10}'.format(
+            ('  ' * t['depth'] + name)[:32], t['calls'], t['wall'], t['cpu'],
+            t['peak_rss'], '' if t['items'] is None else t['items'])
+
+
+def dump(file_path):
+    """
+    Writes the records as a Chrome trace if file_path ends
+    in .trace.json, otherwise as a JSON list
+    """
+    if file_path.endswith('.trace.json'):
+        t0 = min(r['start'] for r in records) if records else 0.0
+        out = {'traceEvents': [
+            {'name': r['name'], 'ph': 'X', 'pid': r['pid'], 'tid': r['pid'],
+             'ts': 1e6 * (r['start'] - t0), 'dur': 1e6 * r['wall'],
+             'args': {'cpu': r['cpu'], 'peak_rss': r['peak_rss'],
+                      'peak_growth': r['peak_growth'], 'items': r['items']}}
+            for r in records], 'displayTimeUnit': 'ms'}
+    else:
+        out = records
+    with open(file_path, 'w') as f:
+        json.dump(out, f, indent=1)
+
+
+def report():
+    """
+    Prints the summary and writes the records to the output
+    file, if recording is on
+    """
+    if ENABLED:
+        summary()
+        if OUTPUT:
+            dump(OUTPUT)
+            print 'Stage records written to %s' % OUTPUT
@@ -0,0 +1,88 @@
+import numpy as np
+from hashlib import sha1
+from functools import wraps
+
+
+class cached_property(object):
+    """
+    Property computed on first access and then stored on the instance.
+    Deleting it from the instance (see invalidate) makes the next
+    access compute it again.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
+
+def invalidate(obj, *names):
+    """
+    Drops the named cached properties (all of them if no names are
+    given) and every memoized result of obj
+    """
+    for name in names or [k for k, v in vars(obj.__class__).items()
+                          if isinstance(v, cached_property)]:
+        obj.__dict__.pop(name, None)
+    obj.__dict__.pop('_memo', None)
+
+
+def own_arrays(obj):
+    """
+    The arrays held by obj's attributes, as a dict of their ids
+    to the attribute names
+    """
+    return dict((id(v), k) for k, v in vars(obj).items() if isinstance(v, np.ndarray))
+
+
+def arg_key(x, own=None):
+    """
+    Hashable key for an argument; arrays are keyed on their contents,
+    other than those in own (see own_arrays), which are keyed on the
+    attribute holding them without reading them
+    """
+    if isinstance(x, np.ndarray):
+        if own and id(x) in own:
+            return ('attr', own[id(x)])
+        return ('array', x.dtype.str, x.shape,
+                sha1(np.ascontiguousarray(x).view('uint8')).hexdigest())
+    elif isinstance(x, (list, tuple)):
+        return tuple(arg_key(y, own) for y in x)
+    elif isinstance(x, dict):
+        return tuple(sorted((k, arg_key(v, own)) for k, v in x.items()))
+    return x
+
+
+def memoize(method):
+    """
+    Caches the results of a method for each set of arguments,
+    in the instance's _memo dict. The instance's own arrays (such
+    as a chat's times) are keyed on their names, so calls on them
+    cost nothing to look up.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        own = own_arrays(self)
+        key = (method.__name__, arg_key(args, own), arg_key(kwargs, own))
+        memo = self.__dict__.setdefault('_memo', {})
+        if key not in memo:
+            memo[key] = method(self, *args, **kwargs)
+        return memo[key]
+
+    return wrapper
+
+
+def renderer():
+    """
+    The plotting module, imported on first use so that the
+    analyses never load matplotlib unless something is drawn
+    """
+    from tools import render
+    return render
@@ -1,7 +1,16 @@
+import re
+import numpy as np
 from sys import argv
-from bs4 import BeautifulSoup
-from datetime import datetime as dt
-from pickle import dump
+from io import BytesIO
+from mmap import mmap, ACCESS_READ
+from operator import itemgetter
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+from datetime import datetime as dt, timedelta
+from tools.table import MessageTable
+from tools.store import table_save, table_load, table_append, store_header, source_hash
+from tools.index import TextIndex, index_save, index_load
+from tools.instrument import stage, configure, report
 
 
 class Thread:
@@ -34,62 +43,415 @@ class Thread:
         self.texts = [t.text for t in s.findAll('p')]
 
 
-def date(x):
+# Lookup tables for decoding Facebook date strings
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+     'august', 'september', 'october', 'november', 'december']))
+MONTHS.update((m[:3], i) for m, i in MONTHS.items())
+WEEKDAYS = frozenset(['monday', 'tuesday', 'wednesday', 'thursday',
+                      'friday', 'saturday', 'sunday'])
+ZONES = {'utc': 0, 'gmt': 0, 'bst': 60, 'ist': 60, 'wet': 0, 'west': 60,
+         'cet': 60, 'cest': 120, 'eet': 120, 'eest': 180,
+         'est': -300, 'edt': -240, 'cst': -360, 'cdt': -300,
+         'mst': -420, 'mdt': -360, 'pst': -480, 'pdt': -420}
+EPOCH = dt(1970, 1, 1)
+
+# Decoded date strings, keyed on the raw string
+_dates = {}
+
+# Messages streamed by iter_messages between decoding their dates
+BATCH = 4096
+
+
+def date(x, utc=False):
+    """
+    Converts Facebook date strings to datetime objects. By default
+    the local wall time is returned, with utc=True the timezone
+    suffix is used to convert it to UTC.
+    """
+    d, offset = date_decode(x)
+    if utc and offset:
+        d -= timedelta(minutes=offset)
+    return d
+
+
+def date_decode(x):
+    """
+    Decodes a Facebook date string such as
+    'Monday, April 10, 2017 at 3:04pm UTC+01' into a datetime and
+    its UTC offset in minutes (None if the string has no timezone).
+    Results are cached since many messages share the same minute.
+    """
+    try:
+        return _dates[x]
+    except KeyError:
+        pass
+
+    tokens = x.lower().replace(',', ' ').split()
+    try:
+        at = tokens.index('at')
+    except ValueError:
+        raise ValueError('Unrecognised date string %r' % x)
+
+    # Day part, in either 'Monday, April 10, 2017' or 'Monday, 10 April 2017'
+    month, num = None, []
+    for t in tokens[:at]:
+        if t in MONTHS:
+            month = MONTHS[t]
+        elif t.isdigit():
+            num.append(int(t))
+        elif t not in WEEKDAYS:
+            raise ValueError('Unrecognised date string %r' % x)
+    if month is None or len(num) != 2 or len(tokens) == at + 1:
+        raise ValueError('Unrecognised date string %r' % x)
+    dd, yy = num
+
+    # Clock part, '3:04pm' or '15:04', then any timezone tokens
+    t = tokens[at + 1]
+    hh, _, mm = t.partition(':')
+    if mm[-2:] == 'pm':
+        hh, mm = int(hh) % 12 + 12, int(mm[:-2])
+    elif mm[-2:] == 'am':
+        hh, mm = int(hh) % 12, int(mm[:-2])
+    else:
+        hh, mm = int(hh), int(mm)
+
+    result = dt(yy, month, dd, hh, mm), zone_offset(tokens[at + 2:])
+
+    # Keep the cache bounded on very long chats
+    if len(_dates) >= 1 << 18:
+        _dates.clear()
+    _dates[x] = result
+
+    return result
+
+
+def zone_offset(tokens):
+    """
+    Finds the UTC offset in minutes from the timezone tokens of a
+    date string, e.g. ['utc+01'], ['utc-05:30'] or ['bst'].
+    An explicit UTC/GMT offset takes precedence over a zone name.
+    """
+    offset = None
+    for t in tokens:
+        head, tail = t[:3], t[3:]
+        if head in ('utc', 'gmt') and tail[:1] in ('+', '-'):
+            hh, _, mm = tail[1:].partition(':')
+            mins = 60 * int(hh) + int(mm or 0)
+            return -mins if tail[0] == '-' else mins
+        elif t in ZONES:
+            offset = ZONES[t]
+    return offset
+
+
+def dates64(metas, utc=False):
     """
-    Converts Facebook date strings to datetime objects
+    Converts a list of Facebook date strings straight to a
+    datetime64[m] array, decoding each distinct string once.
     """
-    return dt.strptime(x.split(' UTC')[0], '%A, %B %d, %Y at %I:%M%p %Z')
+    minutes = {}
+    for x in metas:
+        if x not in minutes:
+            d = date(x, utc=utc)
+            minutes[x] = int((d - EPOCH).total_seconds()) // 60
+    return np.array([minutes[x] for x in metas],
+                    dtype='int64').view('datetime64[m]')
 
 
-def thread_parse(file_path):
+def soup_messages(file_path, utc=False):
     """
-    Parses message data from a HTML file containing one thread.
+    Builds the full BeautifulSoup tree of a HTML file and
+    returns the list of message dicts from its first thread.
+    With utc=True the times are converted to UTC.
     """
 
     # Open and import file
-    with open(file_path) as f:
+    with stage('read') as s, open(file_path) as f:
         print 'Found file %s' % file_path.split('/')[-1]
         html = f.read()
+        s['items'] = len(html)
 
     # Create a BS object
     print 'Parsing HTML (may take a while)...'
-    soup = BeautifulSoup(html, 'lxml')
+    from bs4 import BeautifulSoup
+    with stage('soup'):
+        soup = BeautifulSoup(html, 'lxml')
+
+    with stage('extract') as s:
+
+        # Collect the thread object from the HTML
+        thread = soup.findAll('div', {'class': 'thread'})[0]
+
+        # Collect the message objects from the thread
+        messages = thread.findAll('div', {'class': 'message'})
+
+        print 'Found %d messages in this thread' % len(messages)
+
+        fields = [message_fields(m) for m in messages]
+        s['items'] = len(fields)
+
+    with stage('dates', len(messages)):
+        times = dates64([meta for user, meta, text in fields], utc).tolist()
+        return [{'sndr': user, 'time': t, 'text': text}
+                for (user, meta, text), t in zip(fields, times)]
+
+
+def message_fields(m):
+    """
+    Reads the sender, date string and body of one message
+    element. The body is every <p> from the message up to the
+    next message, so messages with no body or several
+    paragraphs stay aligned.
+    """
+
+    # Sender and time live in the message's own header
+    user = m.find('span', {'class': 'user'}).text
+    meta = m.find('span', {'class': 'meta'}).text
+
+    # Collect the paragraphs following the message
+    texts = [p.text for p in m.findAll('p')]
+    for s in m.next_siblings:
+        if s.name == 'div' and 'message' in s.get('class', []):
+            break
+        elif s.name == 'p':
+            texts.append(s.text)
+
+    return user, meta, u'\n'.join(texts)
+
+
+def iter_messages(file_path, thread=0, numbered=False, utc=False):
+    """
+    Streams message dicts from a HTML file using incremental lxml
+    events, so memory use stays flat however large the file is.
+    Only the first thread is read by default, pass thread=None to
+    stream every thread in the file. With numbered=True (thread
+    number, message dict) pairs are given, and with utc=True the
+    times are converted to UTC.
+    """
+
+    from lxml.etree import iterparse
+    n, msg, pending = -1, None, []
+
+    for event, el in iterparse(file_path, events=('start', 'end'),
+                               html=True, encoding='utf-8'):
+
+        cls = (el.get('class') or '').split()
+
+        if event == 'start':
+
+            # A new message or thread closes the pending message
+            if el.tag == 'div' and ('message' in cls or 'thread' in cls):
+                if msg is not None:
+                    pending.append(msg)
+                    msg = None
+                if 'thread' in cls:
+                    n += 1
+                    if thread is not None and n > thread:
+                        break
+                elif thread is None or n == thread:
+                    msg = {'sndr': None, 'meta': None, 'text': [], 'thread': n}
 
-    # Collect the thread object from the HTML
-    thread = soup.findAll('div', {'class': 'thread'})[0]
+                # Dates are decoded a batch of messages at a time
+                if len(pending) >= BATCH:
+                    for m in _message_records(pending, numbered, utc):
+                        yield m
+                    pending = []
+            continue
 
-    # Collect all the paragraph text, these are the message bodies
-    texts = [m.text for m in thread.findAll('p')]
+        if msg is not None:
+            if el.tag == 'span' and 'user' in cls:
+                msg['sndr'] = u''.join(el.itertext())
+            elif el.tag == 'span' and 'meta' in cls:
+                msg['meta'] = u''.join(el.itertext())
+            elif el.tag == 'p':
+                msg['text'].append(u''.join(el.itertext()))
 
-    print 'Found %d messages in this thread' % len(texts)
+        # Drop finished elements so the tree never grows
+        if el.tag == 'p' or (el.tag == 'div' and 'message' in cls):
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
 
-    # Collect the message objects from the thread
-    messages = thread.findAll('div', {'class': 'message'})
+    if msg is not None:
+        pending.append(msg)
+    for m in _message_records(pending, numbered, utc):
+        yield m
 
-    # Get the message headers
-    headers = [m.findNext('div', {'class': 'message_header'}) for m in messages]
 
-    # Get the sender from the message headers
-    users = [h.findNext('span', {'class': 'user'}).text for h in headers]
+def _message_records(msgs, numbered=False, utc=False):
+    """
+    Converts the raw strings collected for some messages to message dicts
+    """
+    times = dates64([m['meta'] for m in msgs], utc).tolist()
+    for msg, t in zip(msgs, times):
+        record = {'sndr': msg['sndr'], 'time': t, 'text': u'\n'.join(msg['text'])}
+        yield (msg['thread'], record) if numbered else record
+
+
+def thread_parse(file_path, stream=False, prefix='./input/group_chat', utc=False):
+    """
+    Parses message data from a HTML file containing one thread
+    and saves it to the message store at prefix. With stream=True
+    the file is read incrementally rather than as a single
+    BeautifulSoup tree, and with utc=True times are kept in UTC.
+    """
+
+    with stage('parse'):
+        if stream:
+            print 'Streaming messages from %s' % file_path.split('/')[-1]
+            with stage('stream') as s:
+                master = list(iter_messages(file_path, utc=utc))
+                s['items'] = len(master)
+            print 'Found %d messages in this thread' % len(master)
+        else:
+            master = soup_messages(file_path, utc)
+
+        return messages_save(master, prefix, source_hash(file_path), utc)
+
+
+def thread_update(file_path, prefix='./input/group_chat'):
+    """
+    Adds the messages of a newer export of the same thread to the
+    store at prefix, parsing their times as the store's were. Only
+    messages from the newest stored minute onwards are kept, less
+    any already stored (matched on sender, time and text).
+    Returns a MessageTable of the added messages.
+    """
+    table = table_load(prefix)
+    utc = store_header(prefix).get('utc', False)
+    newest = table.times.max().astype(dt)
+
+    # Count the stored messages sent in the newest minute
+    seen = Counter((table.users[table.sndrs[i]], table.text(i))
+                   for i in np.nonzero(table.times == table.times.max())[0])
+
+    print 'Streaming messages newer than %s from %s' % (
+        newest.strftime('%d/%m/%y %H:%M'), file_path.split('/')[-1])
+
+    new = []
+    for m in iter_messages(file_path, utc=utc):
+        if m['time'] > newest:
+            new.append(m)
+        elif m['time'] == newest:
+            if seen[(m['sndr'], m['text'])] > 0:
+                seen[(m['sndr'], m['text'])] -= 1
+            else:
+                new.append(m)
+
+    print 'Found %d new messages' % len(new)
+
+    new = MessageTable.from_records(new)
+    table_append(new, prefix, source_hash(file_path))
+
+    # Add the new messages to the text index
+    index = index_load(prefix, len(table))
+    table = table_load(prefix)
+    index_save(index.extend(table) if index else TextIndex.build(table), prefix)
+
+    return new
+
+
+def thread_chunks(file_path, n_chunks):
+    """
+    Splits a HTML file into byte ranges of whole threads, grouped
+    into at most n_chunks ranges of roughly equal size.
+    """
+
+    # Find where each thread starts without parsing the file
+    with open(file_path, 'rb') as f:
+        m = mmap(f.fileno(), 0, access=ACCESS_READ)
+        starts = [t.start() for t in re.finditer(br'<div class="thread"', m)]
+        size = m.size()
+        m.close()
+
+    if not starts:
+        return []
+
+    # Group neighbouring threads until each chunk is big enough
+    chunks, target = [], (size - starts[0]) / float(n_chunks)
+    lo = starts[0]
+    for s in starts[1:]:
+        if s - lo >= target:
+            chunks.append((file_path, lo, s))
+            lo = s
+    chunks.append((file_path, lo, size))
+
+    return chunks
+
+
+def chunk_parse(chunk):
+    """
+    Parses every thread in one byte range of a HTML file
+    """
+    file_path, start, end, utc = chunk
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        html = f.read(end - start)
+    return list(iter_messages(BytesIO(html), thread=None, utc=utc))
+
+
+def threads_parse(file_paths, workers=None, prefix='./input/group_chat', utc=False):
+    """
+    Parses every thread of every HTML file given, spreading the
+    work over a pool of processes, and merges the results into a
+    single time-sorted message store at prefix.
+    """
+
+    workers = workers or cpu_count()
 
-    # Get the times from the message headers and conver to datetime
-    times = [date(h.findNext('span', {'class': 'meta'}).text) for h in headers]
+    # Split each file into chunks of threads, a few per worker
+    chunks = [c + (utc,) for file_path in file_paths
+              for c in thread_chunks(file_path, 4 * workers)]
+    print 'Parsing %d files in %d chunks over %d processes...' % (
+        len(file_paths), len(chunks), workers)
 
-    # Create a list of dicts for all messages
-    print 'Saving pickled list of messages at /input/messages.pkl'
-    master = [{'sndr': users[i],
-               'time': times[i],
-               'text': texts[i]}
-              for i in range(len(texts))]
+    pool = Pool(workers)
+    try:
+        with stage('parse', len(chunks)):
+            parts = pool.map(chunk_parse, chunks)
+    finally:
+        pool.close()
+        pool.join()
 
-    # Pickle the messages
-    with open('./input/group_chat.pkl', 'w') as f:
-        dump(master, f)
+    # Merge and sort by time, keeping file order for equal times
+    with stage('merge'):
+        master = sorted((m for p in parts for m in p), key=itemgetter('time'))
+    print 'Found %d messages in %d files' % (len(master), len(file_paths))
 
-    return master
+    return messages_save(master, prefix, source_hash(file_paths), utc, True)
+
+
+def messages_save(master, prefix, source=None, utc=False, threads=False):
+    """
+    Converts the list of messages to a MessageTable and saves it
+    to the message store at prefix, along with its text index
+    """
+    print 'Saving messages to the store at %s' % prefix
+    with stage('table', len(master)):
+        table = MessageTable.from_records(master)
+    with stage('save', len(table)):
+        table_save(table, prefix, source, utc, threads)
+
+    print 'Indexing message texts...'
+    with stage('index', len(table)):
+        index_save(TextIndex.build(table), prefix)
+
+    return table
 
 
 if __name__ == '__main__':
 
-    # If ran independently, takes the HTML file path as input
-    thread_parse(argv[1])
+    # If ran independently, takes the HTML file path(s) as input
+    configure(argv)
+    if '-threads' in argv:
+        table = threads_parse([a for a in argv[1:] if not a.startswith('-')],
+                              utc='-utc' in argv)
+    else:
+        table = thread_parse(argv[1], stream='-stream' in argv, utc='-utc' in argv)
+
+    # Also write Arrow and Parquet files of the messages
+    if '-arrow' in argv:
+        from tools.arrow import arrow_export
+        arrow_export(table, './input/group_chat')
+
+    report()
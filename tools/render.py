@@ -0,0 +1,261 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import rcParams
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from mpl_toolkits.axes_grid1 import make_axes_locatable
+from tools import instrument
+from tools.instrument import stage
+plt.style.use('ggplot')
+rcParams['figure.figsize'] = (13, 8)
+rcParams['font.family'] = 'monospace'
+
+# The draw functions only take arrays already computed by GroupChat,
+# so that a batch of them can be rendered in other processes
+
+
+def time_plot(timex, timey, avg, bin_size):
+    """
+    Total messages per bin over time, with their moving average
+    """
+    fig, ax = plt.subplots()
+    ax.plot(timex.astype(datetime), timey[:len(timex)] / bin_size, color='C0', alpha=0.1)
+    ax.plot(timex.astype(datetime), avg / bin_size, color='C0')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Avg. Messages per Day')
+    ax.set_ylim([0, np.max(avg / bin_size) * 1.1])
+
+    fig.tight_layout()
+    fig = fig_watermark(fig, 'All-User Lifetime Activity')
+    save(fig, './plots/all-user_lifetime_activity.png')
+    return fig
+
+
+def time_plot_user(names, times, avgs, bin_size):
+    """
+    Moving average of each named user's messages over time
+    """
+    fig, ax = plt.subplots()
+    for name, t, avg in zip(names, times, avgs):
+        ax.plot(t.astype(datetime), avg / bin_size, label=name)
+    ax.legend()
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Avg. Messages per Day')
+
+    fig.tight_layout()
+    fig = fig_watermark(fig, '%d User Lifetime Activity' % len(names))
+    file_string = '_'.join(map(lambda x: x.replace(' ', '_'), names))
+
+    # Too many names to fit in a file name
+    if len(file_string.encode('utf-8')) > 200:
+        file_string = '%d_User' % len(names)
+    save(fig, './plots/%s_lifetime_activity.png' % file_string)
+    return fig
+
+
+def matrix_plot(convo_matrix, initials, title='Conversation Matrix',
+                label="Amount of $Y$'s Conversation Which is Shared With $X$ (%)",
+                file_name='Conversation_Matrix_All_User'):
+    """
+    A user x user matrix (by default the conversation matrix),
+    labelled with the users' initials
+    """
+    fig, ax = plt.subplots()
+    imax = ax.imshow(convo_matrix, interpolation='none')
+    ax.grid(False)
+    ax.set_xticks(range(len(initials)))
+    ax.set_xticklabels(initials, rotation=90.0)
+    ax.set_yticks(range(len(initials)))
+    ax.set_yticklabels(initials)
+    ax.set_xlabel('Person $X$')
+    ax.set_ylabel('Person $Y$')
+    for i in range(len(initials)):
+        for j in range(len(initials)):
+            ax.text(i, j, '%.0f' % convo_matrix[j, i],
+                    color='w', va='center', ha='center')
+    divider = make_axes_locatable(ax)
+    cax1 = divider.append_axes("right", size="3%", pad=0.5)
+    cbar = plt.colorbar(imax, cax=cax1)
+    cbar.set_label(label, labelpad=10.0)
+    fig.set_size_inches(10, 10)
+    fig.tight_layout()
+    fig = fig_watermark(fig, title)
+    save(fig, './plots/%s.png' % file_name)
+    return fig
+
+
+def word_plot(labels, times, rates, bin_size, full_string):
+    """
+    Occurrence rate of each group of words over time
+    """
+    fig, ax = plt.subplots()
+    for label, t, rate in zip(labels, times, rates):
+        ax.plot(t.astype(datetime), rate, label=label)
+
+    ax.legend()
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Occurrence Rate per %d Days (%%)' % bin_size)
+
+    fig.tight_layout()
+    fig = fig_watermark(fig, 'Usage for %s' % full_string)
+    save(fig, './plots/Word_Usage_%s.png' % full_string)
+    return fig
+
+
+def daily_plot(title, avgs, names=None, raw=None):
+    """
+    Moving averages of messages per minute over the day, one for
+    each of names, or one for the whole group drawn over its raw counts
+    """
+    fig, ax = plt.subplots()
+    x = np.linspace(0.0, 24.0, 1440)
+
+    if names:
+        for name, avg in zip(names, avgs):
+            ax.plot(x, avg, label=name, )
+            ax.legend()
+    else:
+        ax.plot(x, raw, color='k', alpha=0.1)
+        ax.plot(x, avgs[0])
+
+    ax.set_ylabel('Messages per minute')
+    ax.set_xticks(np.linspace(0.0, 24.0, 25))
+    ax.set_xlabel('Hour of Day')
+
+    fig.tight_layout()
+    fig = fig_watermark(fig, title)
+    save(fig, './plots/%s.png' % title)
+    return fig
+
+
+def weekly_plot(avg):
+    """
+    Messages per minute over the week, shape (7, 1440)
+    """
+    fig, ax = plt.subplots()
+    imax = ax.imshow(avg, extent=[0, 24, 0, 0.6 * 24], origin='lower')
+
+    ax.set_yticks(np.linspace(1.0, 0.6 * 24 - 1.0, 7))
+    ax.set_xticks(np.linspace(0.0, 24.0, 25))
+
+    ax.set_ylabel('Day of Week')
+    ax.set_xlabel('Hour of Day')
+    ax.set_yticklabels(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+
+    ax.grid(False)
+    divider = make_axes_locatable(ax)
+    cax1 = divider.append_axes("right", size="3%", pad=0.5)
+    cbar = plt.colorbar(imax, cax=cax1)
+
+    cbar.set_label("Messages per Minute",
+                   labelpad=10.0)
+    fig.tight_layout()
+    fig = fig_watermark(fig, 'Weekly Activity')
+    save(fig, './plots/Group_Daily_Weekly_Activity.png')
+    return fig
+
+
+def message_length_plot(length_dist=None, counts=None):
+    """
+    Histogram of the message lengths in words, given either for each
+    message or as counts of the messages of each length
+    """
+    fig, ax = plt.subplots()
+
+    if length_dist is None:
+        lengths = np.arange(len(counts))
+        dist = ax.hist(lengths, bins=np.linspace(1, 50, 50), weights=counts)
+        mean = (lengths * counts).sum() / float(counts.sum())
+    else:
+        dist = ax.hist(length_dist, bins=np.linspace(1, 50, 50))
+        mean = length_dist.mean()
+    ax.text(50, dist[0].max() * 0.9, 'Mean Length = %.2f Words' % mean,
+            size=20, ha='right')
+    ax.set_xlabel('Message Length (Words)')
+    ax.set_ylabel('Frequency')
+    fig.tight_layout()
+    fig = fig_watermark(fig, 'Message Length')
+    save(fig, './plots/Message_Length')
+    return fig
+
+
+def word_length_plot(users, means, percs, mean):
+    """
+    Mean and spread of each user's word lengths, against the
+    mean over all users
+    """
+    fig, ax = plt.subplots()
+    ax.axvline(mean, linestyle='--', color='k', alpha=0.5)
+    ax.errorbar(means, range(1, len(users) + 1), xerr=percs, marker='o', linestyle='none',
+                capsize=5.0)
+    ax.set_xlim([-1, 10])
+    ax.set_yticks(range(1, len(users) + 1))
+    ax.set_yticklabels(users)
+    ax.set_xlim([0.0, 15])
+    ax.set_xlabel('Word Length (chars)')
+    fig.tight_layout()
+    fig = fig_watermark(fig, 'User Word Length Distribution')
+    save(fig, './plots/All_User_Word_Length_Distribution.png')
+    return fig
+
+
+def fig_watermark(fig, title):
+    """
+    Adds a watermark and title to every plot
+    """
+    fig.subplots_adjust(top=0.9)
+    x = fig.axes[0].get_position().x0
+    w = fig.axes[0].get_position().width
+    y = 0.92
+    fig.text(x, y, title, family='serif', size=18)
+    fig.text(x + w, y, "github.com/conor-or/fb-analysis\nConor O'Riordan 2017",
+             family='serif', size=10, ha='right', alpha=0.4)
+    return fig
+
+
+def save(fig, file_path):
+    """
+    Saves a figure, recorded as a stage
+    """
+    with stage('savefig'):
+        fig.savefig(file_path)
+
+
+def draw(job):
+    """
+    Renders one (draw function name, keyword arguments) job and
+    closes its figure. Returns the stages recorded meanwhile, so
+    those of other processes can be added to this one's.
+    """
+    name, kwargs = job
+    first = len(instrument.records)
+    with stage(name):
+        plt.close(globals()[name](**kwargs))
+    return instrument.records[first:]
+
+
+def worker_init():
+    """
+    Renders in the pool's processes without a display
+    """
+    plt.switch_backend('Agg')
+
+
+def batch(jobs, workers=None):
+    """
+    Renders a list of jobs, spread over a pool of workers
+    (one per CPU by default), or in this process if workers=1
+    """
+    workers = min(workers or cpu_count(), len(jobs))
+    if workers <= 1:
+        map(draw, jobs)
+        return
+
+    pool = Pool(workers, initializer=worker_init)
+    try:
+        with stage('render', len(jobs)):
+            for records in pool.map(draw, jobs, chunksize=1):
+                instrument.records.extend(records)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class Replies:
+    """
+    Who replies to whom and how fast, from the time-sorted sender
+    codes. A reply is a message whose sender differs from that of
+    the message before it, sent no more than threshold minutes
+    after it; each one is kept as its pair of users and its latency
+    in whole minutes, so the memory taken grows with the number of
+    replies however many users there are. Turns (runs of messages
+    from one sender) are counted for each user alongside.
+    """
+
+    def __init__(self, pairs, latencies, turns, messages, threshold=30.0, last=None):
+
+        # The i-th reply is by pairs[i] // users to pairs[i] % users,
+        # after latencies[i] minutes
+        self.pairs = pairs
+        self.latencies = latencies
+
+        # Turns taken and messages sent by each user
+        self.turns = turns
+        self.messages = messages
+
+        # Longest latency counted as a reply
+        self.threshold = threshold
+
+        # Time (in minutes) and sender of the last message counted
+        self.last = last
+
+    @classmethod
+    def build(cls, times, sndrs, n_users, threshold=30.0, last=None):
+        """
+        Finds the replies and counts the turns of time-sorted
+        messages. Given the (minute, sender) of the message just
+        before them, as last, the first one may be a reply to it.
+        """
+        minutes = np.asarray(times, dtype='datetime64[m]').astype('int64')
+        sndrs = np.asarray(sndrs, dtype='int64')
+        if last is not None:
+            minutes = np.concatenate([[last[0]], minutes])
+            sndrs = np.concatenate([[last[1]], sndrs])
+
+        # A turn starts wherever the sender changes
+        change = sndrs[1:] != sndrs[:-1]
+        latency = np.diff(minutes)
+        turns = np.bincount(sndrs[1:][change], minlength=n_users)
+        if last is None and len(sndrs):
+            turns[sndrs[0]] += 1
+        messages = np.bincount(sndrs[0 if last is None else 1:], minlength=n_users)
+
+        # Keep the pair and latency of each reply
+        reply = change & (latency <= threshold)
+        pairs = sndrs[1:][reply] * n_users + sndrs[:-1][reply]
+
+        return cls(pairs, latency[reply], turns, messages, threshold,
+                   (minutes[-1], sndrs[-1]) if len(sndrs) else last)
+
+    def extend(self, times, sndrs, n_users):
+        """
+        Adds more messages, all sent after those counted so far,
+        with the same threshold
+        """
+        new = Replies.build(times, sndrs, n_users, self.threshold, self.last)
+        n = len(self.turns)
+
+        # Renumber the pairs counted so far for any new users
+        pairs = self.pairs // n * n_users + self.pairs % n if n else self.pairs
+        new.pairs = np.concatenate([pairs, new.pairs])
+        new.latencies = np.concatenate([self.latencies, new.latencies])
+        new.turns[:n] += self.turns
+        new.messages[:n] += self.messages
+        return new
+
+    @property
+    def counts(self):
+        """
+        Number of replies of each user (rows) to each other (columns)
+        """
+        n = len(self.turns)
+        return np.bincount(self.pairs, minlength=n * n).reshape(n, n)
+
+    def share(self):
+        """
+        Percentage of each user's replies given to each other user
+        """
+        counts = self.counts.astype(float)
+        return 100.0 * counts / counts.sum(axis=1)[:, np.newaxis]
+
+    def mean_latency(self):
+        """
+        Mean minutes taken by each user to reply to each other
+        """
+        n = len(self.turns)
+        total = np.bincount(self.pairs, weights=self.latencies, minlength=n * n)
+        return total.reshape(n, n) / self.counts.astype(float)
+
+    def latency_percentiles(self, q=(50,)):
+        """
+        The q-th percentiles of the minutes taken by each user to
+        reply to each other, as np.percentile gives from the
+        latencies of each pair, shape (users, users, len(q)); NaN
+        for pairs with no replies
+        """
+        n = len(self.turns)
+
+        # Latencies sorted within each pair, and where each pair starts
+        latencies = self.latencies[np.lexsort((self.latencies, self.pairs))]
+        counts = self.counts.ravel()
+        starts = np.cumsum(counts) - counts
+        found = counts > 0
+
+        out = np.full((n * n, len(q)), np.nan)
+        for i, p in enumerate(q):
+
+            # Interpolate between the sorted latencies either side
+            h = (counts[found] - 1) * (p / 100.0)
+            lo = latencies[starts[found] + np.floor(h).astype('int64')]
+            hi = latencies[starts[found] + np.ceil(h).astype('int64')]
+            out[found, i] = lo + (h - np.floor(h)) * (hi - lo)
+
+        return out.reshape(n, n, len(q))
+
+    def turn_length(self):
+        """
+        Mean messages per turn of each user
+        """
+        return self.messages / self.turns.astype(float)
@@ -0,0 +1,214 @@
+"""
+Keeps the results of GroupChat's analyses on disk between runs, so
+that a repeat -all report on an unchanged chat only has to render.
+Each result is an .npz file in ./input/cache named by a hash of the
+messages it was computed from, the method and its arguments; the
+least recently used files are removed once the cache grows past
+its size limit. Off with the -nocache flag.
+"""
+import os
+import json
+import tempfile
+import numpy as np
+from hashlib import sha1
+from functools import wraps
+from tools.lazy import arg_key, own_arrays
+
+# Bump whenever the results of any cached method change
+CACHE_VERSION = 1
+
+# Where the results are kept and how many bytes of them at most
+CACHE_DIR = './input/cache'
+CACHE_SIZE = 256 << 20
+
+# Whether results are kept at all
+ENABLED = True
+
+
+def configure(argv):
+    """
+    Switches the cache off if argv has the -nocache flag
+    """
+    global ENABLED
+    ENABLED = '-nocache' not in argv
+
+
+def store_hash(header, table):
+    """
+    SHA-1 of a message store, from its header (which has the hash
+    of the HTML it was parsed from) and the times of its messages,
+    which may be in UTC or not, without reading the texts
+    """
+    h = sha1(json.dumps([header['version'], header['source_hash'],
+                         header['size'], header['users']]))
+    h.update(np.ascontiguousarray(table.times).view('uint8'))
+    return h.hexdigest()
+
+
+def table_hash(table):
+    """
+    SHA-1 of the contents of a MessageTable
+    """
+    h = sha1(json.dumps(list(table.users)))
+    for col in (table.times, table.sndrs, np.diff(table.offsets),
+                table.blob[table.offsets[0]:table.offsets[-1]]):
+        h.update(np.ascontiguousarray(col).view('uint8'))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    A directory of results, each stored as its arrays and a JSON
+    description of how they fit together
+    """
+
+    def __init__(self, directory=CACHE_DIR, size=CACHE_SIZE):
+        self.directory = directory
+        self.size = size
+
+    def path(self, data_hash, name, args, kwargs, own=None):
+        """
+        File of the result of name(*args, **kwargs) on the data,
+        with the arrays in own keyed as in arg_key
+        """
+        key = repr((CACHE_VERSION, data_hash, name, arg_key(args, own), arg_key(kwargs, own)))
+        return os.path.join(self.directory, '%s-%s.npz' % (name, sha1(key).hexdigest()))
+
+    def get(self, path):
+        """
+        The result stored at path, or None if there is none
+        """
+        try:
+            value = load(path)
+        except (IOError, ValueError):
+            return None
+
+        # Mark it as recently used, unless another process
+        # has evicted it meanwhile
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, path, value):
+        """
+        Stores a result at path, then makes room for it
+        """
+        try:
+            os.makedirs(self.directory)
+        except OSError:
+            if not os.path.isdir(self.directory):
+                raise
+
+        # Each writer has its own temporary file, so processes
+        # storing the same result never clash
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                save(f, value)
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used results until the
+        rest fit in the size limit
+        """
+        # Other processes may remove files as this one goes
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    s = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((s.st_mtime, s.st_size, name))
+
+        total = sum(f[1] for f in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+
+def save(f, value):
+    """
+    Writes a result to a file as .npz
+    """
+    arrays = []
+    spec = encode(value, arrays)
+    np.savez(f, spec=np.frombuffer(json.dumps(spec), dtype='uint8'),
+             **dict(('a%d' % i, a) for i, a in enumerate(arrays)))
+
+
+def load(f):
+    """
+    Reads a result written by save
+    """
+    with np.load(f) as data:
+        arrays = dict(data.items())
+    return decode(json.loads(arrays.pop('spec').tostring()), arrays)
+
+
+def encode(value, arrays):
+    """
+    JSON description of a result made of arrays, numbers and
+    strings in lists, tuples and dicts, adding its arrays to arrays
+    """
+    if isinstance(value, (np.ndarray, np.generic)):
+        arrays.append(np.asarray(value))
+        return {'array' if isinstance(value, np.ndarray) else 'scalar': len(arrays) - 1}
+    elif isinstance(value, (list, tuple)):
+        return {type(value).__name__: [encode(v, arrays) for v in value]}
+    elif isinstance(value, dict):
+        return {'dict': [[k, encode(v, arrays)] for k, v in value.items()]}
+    return {'value': value}
+
+
+def decode(spec, arrays):
+    """
+    The result described by spec, from the arrays stored with it
+    """
+    kind, x = spec.items()[0]
+    if kind == 'array':
+        return arrays['a%d' % x]
+    elif kind == 'scalar':
+        return arrays['a%d' % x][()]
+    elif kind == 'list':
+        return [decode(v, arrays) for v in x]
+    elif kind == 'tuple':
+        return tuple(decode(v, arrays) for v in x)
+    elif kind == 'dict':
+        return dict((str(k), decode(v, arrays)) for k, v in x)
+    return x
+
+
+def persist(method):
+    """
+    Keeps the results of a method of an object with a data_hash
+    and a results cache (None to not keep them) on disk. Put it
+    under memoize, so the disk is only read once per run.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.results is None or not ENABLED:
+            return method(self, *args, **kwargs)
+
+        path = self.results.path(self.data_hash, method.__name__, args, kwargs,
+                                 own_arrays(self))
+        value = self.results.get(path)
+        if value is None:
+            value = method(self, *args, **kwargs)
+            self.results.put(path, value)
+        return value
+
+    return wrapper
@@ -0,0 +1,239 @@
+"""
+Serves queries on one or more loaded chats over HTTP on localhost,
+so scripts and notebooks can use them without loading and analysing
+the messages again each time (see tools/client.py). Run it with the
+prefixes of the message stores to serve:
+
+    python -m tools.server ./input/group_chat [-port=8017] [-workers=N]
+
+Each request is handled on its own thread. The slower queries are
+run on a pool of worker processes, forked once the chats are loaded
+so they share them, and a slow query never holds up the others.
+
+    GET  /chats     names and sizes of the chats
+    POST /query     {"chat": name, "query": name, "args": {...},
+                     "format": "json" or "npz"}
+
+A JSON result has its arrays as lists (dates as strings); an npz
+result is the file tools/results.save writes.
+"""
+import os
+import json
+import numpy as np
+from io import BytesIO
+from sys import argv
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from tools.chat import GroupChat
+from tools.store import table_load
+from tools.client import PORT
+from tools import results
+
+# The chats being served, by name; set before the workers are forked
+chats = OrderedDict()
+
+
+def users(chat):
+    """
+    Names of the users, in the order of their sender codes
+    """
+    return list(chat.users)
+
+
+def message_rank(chat):
+    """
+    Users and their total message counts, most first
+    """
+    counts = chat.totals.astype('int64')
+    rank = np.argsort(-counts, kind='mergesort')
+    return {'users': [chat.users[i] for i in rank], 'counts': counts[rank]}
+
+
+def word_find(chat, words, match='substring'):
+    """
+    Times of the messages containing any of the words
+    """
+    return chat.word_find(words, match)
+
+
+def time_bins(chat, bin_size=1, users=None):
+    """
+    Dates and messages per bin_size days of the whole chat, or
+    of each of the named users
+    """
+    if users is None:
+        return chat.cube.bins(bin_size)
+    return chat.cube.bins(bin_size, users=[chat.users.index(u) for u in users],
+                          per_user=True)
+
+
+def daily_bins(chat, weekday=False, per_user=False):
+    """
+    Messages per minute over the day (or week), of the whole
+    chat or of every user
+    """
+    if per_user:
+        return chat.user_daily_bins(weekday)
+    return chat.group_daily_bins(weekday)
+
+
+def conversation_matrix(chat, threshold=30.0):
+    """
+    The conversation matrix for the threshold (in minutes)
+    """
+    return chat.conversation_matrix(threshold)
+
+
+def replies(chat, threshold=30.0, q=(50,)):
+    """
+    Replies of each user to each other, the q-th percentiles of
+    their latencies, and each user's turns and messages
+    """
+    r = chat.reply_stats(threshold)
+    return {'counts': r.counts, 'percentiles': r.latency_percentiles(q),
+            'turns': r.turns, 'messages': r.messages}
+
+
+QUERIES = {'users': users, 'message_rank': message_rank, 'word_find': word_find,
+           'time_bins': time_bins, 'daily_bins': daily_bins,
+           'conversation_matrix': conversation_matrix, 'replies': replies}
+
+# Queries run on the worker pool rather than the request's thread
+SLOW = set(['word_find', 'daily_bins', 'conversation_matrix', 'replies'])
+
+
+def run(name, query, args):
+    """
+    Answers one query on the named chat
+    """
+    return QUERIES[query](chats[name], **args)
+
+
+def chats_load(prefixes):
+    """
+    Opens the stores at prefixes as chats and computes their
+    sorted messages, conversations, daily counts and text index
+    up front, so the workers are forked with them
+    """
+    for prefix in prefixes:
+        name = os.path.basename(prefix)
+        print 'Loading %s...' % name
+        chat = chats[name] = GroupChat(table_load(prefix), prefix)
+        for prop in ('totals', 'convo_ix', 'cube', 'index'):
+            getattr(chat, prop)
+
+
+def to_json(value):
+    """
+    A result with its arrays as lists, ready for json.dumps
+    """
+    if isinstance(value, np.ndarray):
+        return value.astype(str).tolist() if value.dtype.kind == 'M' else value.tolist()
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((k, to_json(v)) for k, v in value.items())
+    return value
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests of one connection
+    """
+
+    def do_GET(self):
+        if self.path != '/chats':
+            return self.reply_error(404, 'No such path %s' % self.path)
+        self.reply_json([{'name': n, 'size': c.size, 'users': len(c.users)}
+                         for n, c in chats.items()])
+
+    def do_POST(self):
+        if self.path != '/query':
+            return self.reply_error(404, 'No such path %s' % self.path)
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            name = request.get('chat') or chats.keys()[0]
+            query, args = request['query'], request.get('args', {})
+            args = dict((str(k), v) for k, v in args.items())
+        except (ValueError, KeyError, IndexError, AttributeError) as e:
+            return self.reply_error(400, 'Bad request: %s' % e)
+
+        if name not in chats:
+            return self.reply_error(404, 'No chat named %s' % name)
+        if query not in QUERIES:
+            return self.reply_error(404, 'No query named %s' % query)
+
+        # Slow queries wait on the pool, holding up only this thread
+        try:
+            if query in SLOW and self.server.pool is not None:
+                value = self.server.pool.apply(run, (name, query, args))
+            else:
+                value = run(name, query, args)
+        except Exception as e:
+            return self.reply_error(500, '%s: %s' % (type(e).__name__, e))
+
+        if request.get('format') == 'npz':
+            f = BytesIO()
+            results.save(f, value)
+            self.reply(f.getvalue(), 'application/octet-stream')
+        else:
+            self.reply_json(to_json(value))
+
+    def reply(self, body, content_type, code=200):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, value, code=200):
+        self.reply(json.dumps(value), 'application/json', code)
+
+    def reply_error(self, code, message):
+        self.reply_json({'error': message}, code)
+
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    """
+    Handles each request on a new thread
+    """
+    daemon_threads = True
+
+    def __init__(self, port=PORT, pool=None):
+        HTTPServer.__init__(self, ('localhost', port), QueryHandler)
+        self.pool = pool
+
+
+def serve(prefixes, port=PORT, workers=None):
+    """
+    Loads the chats and serves queries on them until interrupted
+    """
+    chats_load(prefixes)
+    workers = workers or cpu_count()
+    pool = Pool(workers) if workers > 1 else None
+    server = QueryServer(port, pool)
+
+    print 'Serving %d chats on http://localhost:%d' % (len(chats), port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if pool is not None:
+            pool.terminate()
+
+
+if __name__ == '__main__':
+
+    # Takes the store prefixes, the port and the number of workers
+    results.configure(argv)
+    port = [int(a.split('=')[1]) for a in argv if a.startswith('-port=')]
+    workers = [int(a.split('=')[1]) for a in argv if a.startswith('-workers=')]
+    serve([a for a in argv[1:] if not a.startswith('-')] or ['./input/group_chat'],
+          port[0] if port else PORT, workers[0] if workers else None)
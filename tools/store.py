@@ -0,0 +1,146 @@
+import os
+import json
+import numpy as np
+from hashlib import sha1
+from tools.table import MessageTable
+
+# Bump whenever the layout of the files below changes
+STORE_VERSION = 1
+
+
+def store_paths(prefix):
+    """
+    Files making up the message store at prefix:
+    a JSON header, one .npy file per column and the raw text buffer
+    """
+    return {'header': prefix + '.json',
+            'times': prefix + '.times.npy',
+            'sndrs': prefix + '.sndrs.npy',
+            'offsets': prefix + '.offsets.npy',
+            'text': prefix + '.text'}
+
+
+def source_hash(file_paths):
+    """
+    SHA-1 of the contents of one or more HTML files
+    """
+    h = sha1()
+    for file_path in ([file_paths] if isinstance(file_paths, basestring) else file_paths):
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def table_save(table, prefix, source=None, utc=False, threads=False):
+    """
+    Writes a MessageTable to disk. source is the hash of the HTML
+    the messages were parsed from, utc whether their times were
+    converted to UTC and threads whether every thread was parsed.
+    """
+    paths = store_paths(prefix)
+
+    # Remove the old header first so a half-written store is never loaded
+    if os.path.exists(paths['header']):
+        os.remove(paths['header'])
+
+    array_save(paths['times'], np.asarray(table.times, dtype='datetime64[m]'))
+    array_save(paths['sndrs'], np.asarray(table.sndrs, dtype='int32'))
+    array_save(paths['offsets'], np.asarray(table.offsets - table.offsets[0], dtype='int64'))
+    with open(paths['text'] + '.tmp', 'wb') as f:
+        f.write(table.blob[table.offsets[0]:table.offsets[-1]].tostring())
+    os.rename(paths['text'] + '.tmp', paths['text'])
+
+    with open(paths['header'], 'w') as f:
+        json.dump({'version': STORE_VERSION, 'source_hash': source,
+                   'size': len(table), 'users': table.users,
+                   'utc': utc, 'threads': threads}, f)
+
+
+def array_save(path, arr):
+    """
+    Saves an array as .npy via a temporary file, so any existing
+    memory map of the old file stays valid
+    """
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, arr)
+    os.rename(path + '.tmp', path)
+
+
+def table_append(new, prefix, source=None):
+    """
+    Appends the messages of a MessageTable to the store at prefix.
+    The text is appended to the text file in place, only the
+    (much smaller) column files are rewritten. The messages should
+    be parsed as the store's were (see its header).
+    """
+    paths = store_paths(prefix)
+    header = store_header(prefix)
+    if header is None:
+        raise IOError('No message store of version %d at %s' % (STORE_VERSION, prefix))
+
+    # New senders get the next codes
+    users = header['users'] + [u for u in new.users if u not in header['users']]
+    codes = np.array([users.index(u) for u in new.users], dtype='int32')
+
+    # Read the old columns fully before overwriting their files
+    times = np.load(paths['times'])
+    sndrs = np.load(paths['sndrs'])
+    offsets = np.load(paths['offsets'])
+
+    os.remove(paths['header'])
+
+    with open(paths['text'], 'ab') as f:
+        f.write(new.blob[new.offsets[0]:new.offsets[-1]].tostring())
+    array_save(paths['times'], np.concatenate(
+        [times, np.asarray(new.times, dtype='datetime64[m]')]))
+    array_save(paths['sndrs'], np.concatenate(
+        [sndrs, codes[new.sndrs] if len(codes) else new.sndrs]).astype('int32'))
+    array_save(paths['offsets'], np.concatenate(
+        [offsets, offsets[-1] + new.offsets[1:] - new.offsets[0]]))
+
+    with open(paths['header'], 'w') as f:
+        json.dump({'version': STORE_VERSION, 'source_hash': source,
+                   'size': len(times) + len(new), 'users': users,
+                   'utc': header.get('utc', False),
+                   'threads': header.get('threads', False)}, f)
+
+
+def store_header(prefix):
+    """
+    Reads the header of the store at prefix, or returns None if
+    there is no complete store of the current version there.
+    """
+    try:
+        with open(store_paths(prefix)['header']) as f:
+            header = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    return header if header.get('version') == STORE_VERSION else None
+
+
+def table_load(prefix, mmap=True):
+    """
+    Opens the store at prefix as a MessageTable. With mmap=True the
+    columns are memory-mapped rather than read into memory.
+    """
+    header = store_header(prefix)
+    if header is None:
+        raise IOError('No message store of version %d at %s' % (STORE_VERSION, prefix))
+
+    paths = store_paths(prefix)
+    mode = 'r' if mmap else None
+
+    if os.path.getsize(paths['text']) == 0:
+        blob = np.zeros(0, dtype='uint8')
+    elif mmap:
+        blob = np.memmap(paths['text'], dtype='uint8', mode='r')
+    else:
+        blob = np.fromfile(paths['text'], dtype='uint8')
+
+    return MessageTable(np.load(paths['times'], mmap_mode=mode),
+                        np.load(paths['sndrs'], mmap_mode=mode),
+                        header['users'],
+                        np.load(paths['offsets'], mmap_mode=mode),
+                        blob)
@@ -0,0 +1,166 @@
+"""
+Writes synthetic Facebook messages.htm exports for testing and
+benchmarking, e.g. from the repository root
+
+    python -m tools.synth ./input/synth.htm 1000000 20
+"""
+import numpy as np
+from sys import argv
+from cgi import escape
+
+FIRST = ['Alice', 'Bob', 'Carol', 'Dan', 'Emma', 'Finn', 'Grace', 'Harry',
+         'Isla', 'Jack', 'Kate', 'Liam', 'Mia', 'Noah', 'Olivia', 'Paddy',
+         'Rose', 'Sean', 'Tara', 'Will', u'Zo\xeb', u'Se\xe1n']
+LAST = ['Smith', 'Jones', 'Murphy', 'Kelly', 'Brown', 'Walsh', 'Byrne',
+        'Ryan', 'Taylor', 'Wilson', "O'Brien", u'N\xed Bhriain', 'Clarke']
+WORDS = (u'the i you to a and it is that of in lol what no yes ok haha are '
+         u'for be on have just so was like we me my this not do its going '
+         u'up tonight pub anyone out get now know can at who think one '
+         u'yeah he she they want come coming time good see will all when '
+         u'there how why got home would here need sure sorry thanks tomorrow '
+         u'caf\xe9 na\xefve \U0001f602 \U0001f44d <3 & "quoted" '
+         u'http://example.com/x?a=1&b=2').split()
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+             'Saturday', 'Sunday']
+
+# Relative activity in each hour of the day, quiet overnight
+HOURLY = np.array([3, 2, 1, 0.5, 0.3, 0.3, 0.5, 1, 2, 3, 4, 5,
+                   6, 6, 5, 5, 5, 6, 7, 8, 9, 9, 8, 5], dtype=float)
+
+# Messages generated and written at once
+CHUNK = 1 << 16
+
+
+def user_names(n_users):
+    """
+    n_users distinct names, every 50th one left as a raw
+    Facebook ID as happens in real exports
+    """
+    names = []
+    for i in range(n_users):
+        if i % 50 == 49:
+            names.append(u'%d@facebook.com' % (100000000 + i))
+        else:
+            first = FIRST[i % len(FIRST)]
+            last = LAST[(i + i // len(FIRST)) % len(LAST)]
+            names.append(u'%s %s' % (first, last) if i < len(FIRST) * len(LAST)
+                         else u'%s %s %d' % (first, last, i))
+    return names
+
+
+def message_times(rng, n, years=3.0, start='2014-01-01'):
+    """
+    Sorted datetime64[m] times of n messages in bursts of
+    conversation, spread over years and weighted to the daytime
+    """
+    # Conversations of around 20 messages a couple of minutes apart,
+    # with exponential gaps between them filling the time span
+    starts = rng.random_sample(n) < 1.0 / 20
+    mean_gap = years * 525600.0 * 20 / max(n, 1)
+    gaps = np.where(starts, rng.exponential(mean_gap, n), rng.exponential(1.5, n))
+    clock = np.cumsum(gaps)
+
+    # Warp the time within each day so it follows the hourly activity,
+    # keeping the messages in order
+    cdf = np.cumsum(np.repeat(HOURLY / 60.0, 60))
+    cdf /= cdf[-1]
+    days, frac = np.divmod(clock, 1440.0)
+    minute = np.searchsorted(cdf, frac / 1440.0)
+
+    minutes = (days * 1440 + np.minimum(minute, 1439)).astype('int64')
+    return np.datetime64(start, 'm') + np.maximum.accumulate(minutes)
+
+
+def meta_strings(times):
+    """
+    Facebook date strings for datetime64[m] times, e.g.
+    'Monday, April 10, 2017 at 3:04pm UTC+01', in UK time
+    """
+    minutes = times.astype('int64')
+    days = times.astype('datetime64[D]')
+    months = times.astype('datetime64[M]')
+    years = times.astype('datetime64[Y]').astype('int64') + 1970
+    month = months.astype('int64') % 12
+    day = (days - months).astype('int64') + 1
+    weekday = (minutes // 1440 + 3) % 7
+    hour, minute = (minutes // 60) % 24, minutes % 60
+
+    # Summer time, roughly
+    summer = (month >= 3) & (month <= 9)
+    hour = (hour + summer) % 24
+
+    return [u'%s, %s %d, %d at %d:%02d%s UTC+%02d' % (
+        DAY_NAMES[w], MONTH_NAMES[m], d, y, (h - 1) % 12 + 1, mm,
+        'pm' if h >= 12 else 'am', s)
+        for w, m, d, y, h, mm, s in zip(weekday, month, day, years, hour, minute, summer)]
+
+
+def message_html(rng, names, weights, times):
+    """
+    HTML of one chunk of messages, as one string
+    """
+    n = len(times)
+    sndrs = rng.choice(len(names), n, p=weights)
+
+    # Mostly short messages, from a Zipf-like vocabulary, with the
+    # odd one split over paragraphs or with no text at all
+    lengths = rng.geometric(0.15, n)
+    ranks = 1.0 / np.arange(1, len(WORDS) + 1)
+    words = rng.choice(len(WORDS), lengths.sum(), p=ranks / ranks.sum())
+    ends = np.cumsum(lengths)
+    paras = rng.random_sample(n)
+
+    out = []
+    for i, meta in enumerate(meta_strings(times)):
+        text = escape(u' '.join(WORDS[w] for w in words[ends[i] - lengths[i]:ends[i]]),
+                      quote=True)
+        if paras[i] < 0.01:
+            body = u''
+        elif paras[i] < 0.03:
+            body = u'<p>%s</p><p>%s</p>' % (text, text)
+        else:
+            body = u'<p>%s</p>' % text
+        out.append(u'<div class="message"><div class="message_header">'
+                   u'<span class="user">%s</span><span class="meta">%s</span>'
+                   u'</div></div>%s' % (escape(names[sndrs[i]]), meta, body))
+
+    return u''.join(out).encode('utf-8')
+
+
+def synth_export(file_path, n_messages, n_users, threads=1, seed=0, years=3.0):
+    """
+    Writes a synthetic messages.htm with n_messages messages from
+    n_users users, split evenly over a number of threads, in the
+    div.thread / div.message / span.user / span.meta / p structure
+    of a Facebook export. The same seed always gives the same file.
+    """
+    rng = np.random.RandomState(seed)
+    names = user_names(n_users)
+
+    # A few users do most of the talking
+    weights = 1.0 / np.arange(1, n_users + 1) ** 0.8
+    weights = weights[rng.permutation(n_users)] / weights.sum()
+
+    with open(file_path, 'wb') as f:
+        f.write('<html><head><title>Messages</title></head><body>'
+                '<div class="contents"><h1>%s</h1>\n' % names[0].encode('utf-8'))
+
+        for t in range(threads):
+            size = n_messages // threads + (t < n_messages % threads)
+            times = message_times(rng, size, years)
+            f.write('<div class="thread">%s\n' % escape(u', '.join(names)).encode('utf-8'))
+            for lo in range(0, size, CHUNK):
+                f.write(message_html(rng, names, weights, times[lo:lo + CHUNK]))
+                f.write('\n')
+            f.write('</div>\n')
+
+        f.write('</div></body></html>\n')
+
+
+if __name__ == '__main__':
+
+    synth_export(argv[1], int(argv[2]), int(argv[3]),
+                 seed=int(argv[4]) if len(argv) > 4 else 0)
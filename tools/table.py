@@ -0,0 +1,185 @@
+import numpy as np
+from datetime import datetime
+
+
+class MessageTable:
+    """
+    Holds messages in columns rather than as a list of dicts:
+    a datetime64[m] array of times, an integer array of sender
+    codes into the users list, and all the message bodies in one
+    UTF-8 buffer with an array of offsets into it.
+    """
+
+    def __init__(self, times, sndrs, users, offsets, blob):
+
+        # Message times to the minute
+        self.times = times
+
+        # Sender of each message as an index into users
+        self.sndrs = sndrs
+        self.users = users
+
+        # Text of message i is blob[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_records(cls, master):
+        """
+        Builds a table from a list of message dicts
+        """
+        users, codes = [], {}
+        sndrs = np.empty(len(master), dtype='int32')
+        lengths = np.empty(len(master), dtype='int64')
+        texts = []
+
+        for i, m in enumerate(master):
+
+            # Give each new sender the next code
+            if m['sndr'] not in codes:
+                codes[m['sndr']] = len(users)
+                users.append(m['sndr'])
+            sndrs[i] = codes[m['sndr']]
+
+            # Encode the text for the buffer
+            texts.append(m['text'].encode('utf-8'))
+            lengths[i] = len(texts[-1])
+
+        return cls(np.array([m['time'] for m in master], dtype='datetime64[m]'),
+                   sndrs, users, offsets_from_lengths(lengths),
+                   np.frombuffer(''.join(texts), dtype='uint8'))
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Joins several tables into one, merging their user lists
+        """
+        users, codes, sndrs = [], {}, []
+        for t in tables:
+            for u in t.users:
+                if u not in codes:
+                    codes[u] = len(users)
+                    users.append(u)
+            remap = np.array([codes[u] for u in t.users], dtype='int32')
+            sndrs.append(remap[t.sndrs] if len(t.users) else t.sndrs)
+
+        lengths = np.concatenate([np.diff(t.offsets) for t in tables])
+        return cls(np.concatenate([t.times for t in tables]),
+                   np.concatenate(sndrs).astype('int32'), users,
+                   offsets_from_lengths(lengths),
+                   np.concatenate([t.blob[t.offsets[0]:t.offsets[-1]]
+                                   for t in tables]))
+
+    def __len__(self):
+        return len(self.times)
+
+    def text(self, i):
+        """
+        Decodes the text of message i
+        """
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tostring().decode('utf-8')
+
+    def texts(self, ix=None):
+        """
+        Generator over the decoded texts of all (or the indexed) messages
+        """
+        for i in (range(len(self)) if ix is None else ix):
+            yield self.text(i)
+
+    def record(self, i):
+        """
+        Message i as a dict, as found in the old master list
+        """
+        return {'sndr': self.users[self.sndrs[i]],
+                'time': self.times[i].astype(datetime),
+                'text': self.text(i)}
+
+    def records(self, ix=None):
+        """
+        A list-like view of the messages as dicts
+        """
+        return MessageView(self, ix)
+
+    def take(self, ix):
+        """
+        Returns a new table holding only the indexed messages
+        """
+        ix = np.asarray(ix, dtype='int64')
+        starts = self.offsets[:-1][ix]
+        lengths = self.offsets[1:][ix] - starts
+        offsets = offsets_from_lengths(lengths)
+
+        # Gather the bytes of each message into a new buffer
+        pos = (np.repeat(starts - offsets[:-1], lengths) +
+               np.arange(offsets[-1], dtype='int64'))
+
+        return MessageTable(self.times[ix], self.sndrs[ix], list(self.users),
+                            offsets, self.blob[pos])
+
+    def argsort(self):
+        """
+        Indices that sort the messages by time (oldest first)
+        """
+        return np.argsort(self.times, kind='mergesort')
+
+
+class MessageView:
+    """
+    Read-only sequence over some or all messages of a table,
+    giving either the message dicts or a single field of each
+    ('sndr', 'time' or 'text').
+    """
+
+    def __init__(self, table, ix=None, field=None):
+        self.table = table
+        self.ix = ix
+        self.field = field
+
+    def __len__(self):
+        return len(self.table) if self.ix is None else len(self.ix)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            ix = np.arange(len(self))[i] if self.ix is None else self.ix[i]
+            return MessageView(self.table, ix, self.field)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('message index out of range')
+        j = i if self.ix is None else self.ix[i]
+        if self.field is None:
+            return self.table.record(j)
+        elif self.field == 'text':
+            return self.table.text(j)
+        elif self.field == 'time':
+            return self.table.times[j].astype(datetime)
+        else:
+            return self.table.users[self.table.sndrs[j]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def indices(self):
+        """
+        Indices of the viewed messages in the table
+        """
+        return np.arange(len(self.table)) if self.ix is None else self.ix
+
+    def sorted(self, reverse=False):
+        """
+        The same messages ordered by time
+        """
+        ix = self.indices()
+        order = np.argsort(self.table.times[ix], kind='mergesort')
+        return MessageView(self.table, ix[order[::-1] if reverse else order],
+                           self.field)
+
+
+def offsets_from_lengths(lengths):
+    """
+    Converts an array of text lengths to buffer offsets
+    """
+    offsets = np.zeros(len(lengths) + 1, dtype='int64')
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
@@ -0,0 +1,136 @@
+import numpy as np
+
+# Bytes of text handled at once
+BLOCK = 1 << 22
+
+SPACE = ord(' ')
+
+
+class TextStats:
+    """
+    Word statistics of every message of a MessageTable, made in one
+    pass over its UTF-8 text buffer without decoding any text.
+    Words are split on single spaces, exactly as text.split(' '),
+    and their lengths are in characters, counted as the bytes that
+    are not UTF-8 continuation bytes. Holds the number of words of
+    each message and, for each user, a histogram of word lengths;
+    everything else is a cheap reduction of those.
+    """
+
+    def __init__(self, word_counts, sndrs, length_hist):
+
+        # Number of words in each message, and its sender code
+        self.word_counts = word_counts
+        self.sndrs = sndrs
+
+        # length_hist[u, k] is the number of words of k characters sent by user u
+        self.length_hist = length_hist
+
+    @classmethod
+    def build(cls, table, start=0):
+        """
+        Counts the words of messages start onwards of the table
+        """
+        n, n_users = len(table), len(table.users)
+        word_counts = np.zeros(n - start, dtype='int64')
+        length_hist = np.zeros((n_users, 1), dtype='int64')
+
+        lo = start
+        while lo < n:
+            hi = max(lo + 1, np.searchsorted(table.offsets, table.offsets[lo] + BLOCK) - 1)
+            hi = min(hi, n)
+            counts, hist = block_stats(table, lo, hi)
+            word_counts[lo - start:hi - start] = counts
+            length_hist = hist_add(length_hist, hist)
+            lo = hi
+
+        return cls(word_counts, np.asarray(table.sndrs[start:]), length_hist)
+
+    def extend(self, table):
+        """
+        Statistics of the table, given these cover its first
+        len(self.word_counts) messages
+        """
+        new = TextStats.build(table, len(self.word_counts))
+        return TextStats(np.concatenate([self.word_counts, new.word_counts]),
+                         np.concatenate([self.sndrs, new.sndrs]),
+                         hist_add(self.length_hist, new.length_hist))
+
+    def message_length_counts(self, per_user=False):
+        """
+        Number of messages of each length in words, for
+        each user with per_user=True
+        """
+        width = int(self.word_counts.max(initial=0)) + 1
+        if not per_user:
+            return np.bincount(self.word_counts, minlength=width)
+        n_users = len(self.length_hist)
+        counts = np.bincount(self.sndrs * width + self.word_counts, minlength=n_users * width)
+        return counts.reshape(n_users, width)
+
+    def message_length_stats(self):
+        """
+        Mean and standard deviation of each user's message lengths
+        in words, and the mean over all messages
+        """
+        means, stds = hist_stats(self.message_length_counts(per_user=True))
+        return means, stds, self.word_counts.mean()
+
+    def word_length_stats(self):
+        """
+        Mean and standard deviation of each user's word lengths,
+        and the mean over all words
+        """
+        means, stds = hist_stats(self.length_hist)
+        return means, stds, hist_stats(self.length_hist.sum(axis=0)[np.newaxis])[0][0]
+
+
+def block_stats(table, lo, hi):
+    """
+    Words per message and the per-user word length histogram
+    of messages lo to hi
+    """
+    base = table.offsets[lo]
+    buf = np.asarray(table.blob[base:table.offsets[hi]])
+    offsets = table.offsets[lo:hi + 1] - base
+
+    # A message has one word more than it has spaces
+    space = buf == SPACE
+    msg = np.repeat(np.arange(hi - lo), np.diff(offsets))
+    counts = np.bincount(msg[space], minlength=hi - lo) + 1
+
+    # Number every word of the block: each byte belongs to the word
+    # of its message after the spaces so far
+    word = msg + np.cumsum(space) - space
+    chars = ~space & ((buf & 0xC0) != 0x80)
+    lengths = np.bincount(word[chars], minlength=counts.sum())
+
+    # Then count the lengths of each sender's words
+    users = np.repeat(np.asarray(table.sndrs[lo:hi], dtype='int64'), counts)
+    width = int(lengths.max(initial=0)) + 1
+    n_users = len(table.users)
+    hist = np.bincount(users * width + lengths, minlength=n_users * width)
+
+    return counts, hist.reshape(n_users, width)
+
+
+def hist_add(a, b):
+    """
+    Sum of two histograms of different shapes (more users or longer words)
+    """
+    out = np.zeros(np.maximum(a.shape, b.shape), dtype='int64')
+    out[:a.shape[0], :a.shape[1]] += a
+    out[:b.shape[0], :b.shape[1]] += b
+    return out
+
+
+def hist_stats(hist):
+    """
+    Mean and standard deviation of the values counted by each row
+    of a histogram (hist[i, k] counts the value k in row i)
+    """
+    values = np.arange(hist.shape[1])
+    n = hist.sum(axis=1).astype(float)
+    means = hist.dot(values) / n
+    stds = np.sqrt((hist * (values - means[:, np.newaxis]) ** 2).sum(axis=1) / n)
+    return means, stds